@@ -31,6 +31,23 @@ kPluginNodeTypeName = "hrGeneralMuscle"
 hrGeneralMuscleID = OpenMaya.MTypeId( 0x00127 )
 
 
+# cross-section profile of the muscle surface (a periodic cubic circle, its
+# first 3 CVs repeated at the end) and its knots, the same for every section
+def profileCircle():
+	cvs = OpenMaya.MPointArray()
+	for x, z in ( ( -0.424779, -1.025506 ), ( 0.424779, -1.025506 ), ( 1.025506, -0.424779 ), ( 1.025506, 0.424779 ),
+				  ( 0.424779, 1.025506 ), ( -0.424779, 1.025506 ), ( -1.025506, 0.424779 ), ( -1.025506, -0.424779 ),
+				  ( -0.424779, -1.025506 ), ( 0.424779, -1.025506 ), ( 1.025506, -0.424779 ) ):
+		cvs.append( OpenMaya.MPoint( x, 0.0, z, 1.0 ) )
+
+	knots = OpenMaya.MDoubleArray()
+	for knot in range( -2, 11 ):
+		knots.append( float( knot ) )
+	return ( cvs, knots )
+
+kProfileCVs, kProfileKnots = profileCircle()
+
+
 #==================================================
 # Node definition
 class hrGeneralMuscle( OpenMayaMPx.MPxNode ):
@@ -92,6 +109,31 @@ class hrGeneralMuscle( OpenMayaMPx.MPxNode ):
 	# constructor
 	def __init__(self):
 		OpenMayaMPx.MPxNode.__init__(self)
+		self.inputDataCache = None	# sampled connection points, ups, U and V tangents and which ups, see getInputData
+	
+	
+	
+	
+	
+	
+	
+	#==================================================
+	# setDependentsDirty
+	# the connection samples stay valid until one of the connection inputs
+	# is dirtied, so one dirty propagation samples each surface only once
+	def setDependentsDirty( self, plug, plugArray ):
+		if( plug == self.connectionPt or plug == self.connectionSurface or plug == self.connectionU or
+			plug == self.connectionV or plug == self.connectionUp or plug == self.connectionFlip ):
+			self.inputDataCache = None
+		
+		return OpenMayaMPx.MPxNode.setDependentsDirty( self, plug, plugArray )
+	
+	
+	# under the evaluation manager setDependentsDirty is not called, so the
+	# connection samples would outlive the inputs they came from; they are
+	# dropped before every evaluation instead and sampled again on first use:
+	def preEvaluation( self, context, evaluationNode ):
+		self.inputDataCache = None
 	
 	
 	
@@ -139,13 +181,10 @@ class hrGeneralMuscle( OpenMayaMPx.MPxNode ):
 	#==================================================
 	def computeMuscleSurface( self, plug, dataBlock ):
 		vol = False
-		curCurveCV = OpenMaya.MPoint()
 		newPt  = OpenMaya.MPoint()
 		muscleMidPts= OpenMaya.MPointArray()
 		surfaceCVs = OpenMaya.MPointArray()
-		allCurveCVs = OpenMaya.MPointArray()
 		uKnots = OpenMaya.MDoubleArray()
-		vKnots = OpenMaya.MDoubleArray()
 		mHeights = OpenMaya.MDoubleArray()
 		mWidths = OpenMaya.MDoubleArray()
 		mObj = OpenMaya.MObject()
@@ -161,8 +200,6 @@ class hrGeneralMuscle( OpenMayaMPx.MPxNode ):
 		adjustedCVsforRest = OpenMaya.MPointArray()
 		adjustedCVsforRest.setLength(44)
 		
-		xform1 = OpenMaya.MMatrix()
-		xform2 = OpenMaya.MMatrix()
 		xform = OpenMaya.MMatrix()
 		
 		divisor = 1.0
@@ -270,34 +307,6 @@ class hrGeneralMuscle( OpenMayaMPx.MPxNode ):
 	
 	
 		for xSection in range( 0, numXsections ):
-			#------------------------------------------------------
-			#  CREATE U CVs
-		
-			allCurveCVs.clear()	
-				
-			curCurveCV0 = OpenMaya.MPoint( -0.424779, 0.000000, -1.025506, 1.0 )
-			allCurveCVs.append( curCurveCV0 )
-			curCurveCV1 = OpenMaya.MPoint( 0.424779, 0.000000, -1.025506, 1.0 )
-			allCurveCVs.append( curCurveCV1 )
-			curCurveCV2 = OpenMaya.MPoint( 1.025506, 0.000000, -0.424779, 1.0 )
-			allCurveCVs.append( curCurveCV2 )
-			curCurveCV3 = OpenMaya.MPoint( 1.025506, 0.000000, 0.424779, 1.0 )
-			allCurveCVs.append( curCurveCV3 )
-			curCurveCV4 = OpenMaya.MPoint( 0.424779, 0.000000, 1.025506, 1.0 )
-			allCurveCVs.append( curCurveCV4 )
-			curCurveCV5 = OpenMaya.MPoint( -0.424779, 0.000000, 1.025506, 1.0 )
-			allCurveCVs.append( curCurveCV5 )
-			curCurveCV6 = OpenMaya.MPoint( -1.025506, 0.000000, 0.424779, 1.0 )
-			allCurveCVs.append( curCurveCV6 )
-			curCurveCV7 = OpenMaya.MPoint( -1.025506, 0.000000, -0.424779, 1.0 )
-			allCurveCVs.append( curCurveCV7 )
-			curCurveCV8 = OpenMaya.MPoint( -0.424779, 0.000000, -1.025506, 1.0 )
-			allCurveCVs.append( curCurveCV8 )
-			curCurveCV9 = OpenMaya.MPoint( 0.424779, 0.000000, -1.025506, 1.0 )
-			allCurveCVs.append( curCurveCV9 )
-			curCurveCV10 = OpenMaya.MPoint( 1.025506, 0.000000, -0.424779, 1.0 )
-			allCurveCVs.append( curCurveCV10 )
-		
 			#------------------------------------------------------
 			# Rotations for spans
 			
@@ -386,89 +395,30 @@ class hrGeneralMuscle( OpenMayaMPx.MPxNode ):
 				rW *= lfactor / 1.0
 				rH *= lfactor
 
-			curXcurvePoint = OpenMaya.MPoint()
+			#------------------------------------------------------
+			#  CREATE U CVs
+			# the profile scaled to the section's height and width (xform1) and placed on
+			# its frame (xform2), both folded into one matrix per section:
+			#	xform1 * xform2 = [ -rH * aVec, cVec, rW * bVec, section point ]
+			curXsectionPt = muscleXsectionPts[xSection]
+			OpenMaya.MScriptUtil.createMatrixFromList( [ -rH * aVec.x, -rH * aVec.y, -rH * aVec.z, 0.0,
+														cVec.x, cVec.y, cVec.z, 0.0,
+														rW * bVec.x, rW * bVec.y, rW * bVec.z, 0.0,
+														curXsectionPt.x, curXsectionPt.y, curXsectionPt.z, 1.0 ], xform )
 			
-			for i in range( 0, 11 ):
-				curXsectionPt = muscleXsectionPts[xSection]
-				curXcurvePoint = allCurveCVs[i]
-				
-				xform1 = OpenMaya.MMatrix()
-				xform1.setToIdentity()
-				
-				val = rH * -1.0
-				OpenMaya.MScriptUtil.setDoubleArray(xform1[0], 0, val)
-				
-				val = 0.0
-				OpenMaya.MScriptUtil.setDoubleArray(xform1[0], 1, val)
-				
-				val = 0.0
-				OpenMaya.MScriptUtil.setDoubleArray(xform1[0], 2, val)
-				
-				val = 0.0
-				OpenMaya.MScriptUtil.setDoubleArray(xform1[1], 0, val)
-				
-				val = 0.0
-				OpenMaya.MScriptUtil.setDoubleArray(xform1[1], 1, val)
-				
-				val = 1.0
-				OpenMaya.MScriptUtil.setDoubleArray(xform1[1], 2, val)
-				
-				val = 0.0
-				OpenMaya.MScriptUtil.setDoubleArray(xform1[2], 0, val)
-				
-				val = rW
-				OpenMaya.MScriptUtil.setDoubleArray(xform1[2], 1, val)
-				
-				val = 0.0
-				OpenMaya.MScriptUtil.setDoubleArray(xform1[2], 2, val)
-				
-				xform2 = OpenMaya.MMatrix()
-				xform2.setToIdentity()
-				
-				OpenMaya.MScriptUtil.setDoubleArray(xform2[0], 0, aVec.x)
-				OpenMaya.MScriptUtil.setDoubleArray(xform2[0], 1, aVec.y)
-				OpenMaya.MScriptUtil.setDoubleArray(xform2[0], 2, aVec.z)
-				OpenMaya.MScriptUtil.setDoubleArray(xform2[1], 0, bVec.x)
-				OpenMaya.MScriptUtil.setDoubleArray(xform2[1], 1, bVec.y)
-				OpenMaya.MScriptUtil.setDoubleArray(xform2[1], 2, bVec.z)
-				OpenMaya.MScriptUtil.setDoubleArray(xform2[2], 0, cVec.x)
-				OpenMaya.MScriptUtil.setDoubleArray(xform2[2], 1, cVec.y)
-				OpenMaya.MScriptUtil.setDoubleArray(xform2[2], 2, cVec.z)
-				OpenMaya.MScriptUtil.setDoubleArray(xform2[3], 0, curXsectionPt.x)
-				OpenMaya.MScriptUtil.setDoubleArray(xform2[3], 1, curXsectionPt.y)
-				OpenMaya.MScriptUtil.setDoubleArray(xform2[3], 2, curXsectionPt.z)
-				
-				xform = xform1 * xform2
-				
-				newPt = allCurveCVs[i] * xform
+			for i in range( 0, kProfileCVs.length() ):
+				newPt = kProfileCVs[i] * xform
 				newPt.w = 1.0
 				
 				adjustedCVsforRest.append(newPt)
 				
 				
 				
-		vKnots = OpenMaya.MDoubleArray()
-		vKnots.clear()
-		
-		vKnots.append( -2.000000 )
-		vKnots.append( -1.000000 )
-		vKnots.append( 0.000000 )
-		vKnots.append( 1.000000 )
-		vKnots.append( 2.000000 )
-		vKnots.append( 3.000000 )
-		vKnots.append( 4.000000 )
-		vKnots.append( 5.000000 )
-		vKnots.append( 6.000000 )
-		vKnots.append( 7.000000 )
-		vKnots.append( 8.000000 )
-		vKnots.append( 9.000000 )
-		vKnots.append( 10.000000 )
-	
 		sData = OpenMaya.MFnNurbsSurfaceData()
 		mSurfObj = sData.create()
 		mSurfFn = OpenMaya.MFnNurbsSurface()
 			
-		mSurfFn.create(adjustedCVsforRest, uKnots, vKnots, 3, 3, OpenMaya.MFnNurbsSurface.kOpen, OpenMaya.MFnNurbsSurface.kPeriodic, False, mSurfObj )
+		mSurfFn.create(adjustedCVsforRest, uKnots, kProfileKnots, 3, 3, OpenMaya.MFnNurbsSurface.kOpen, OpenMaya.MFnNurbsSurface.kPeriodic, False, mSurfObj )
 		
 		muscleSurfaceOutHnd = dataBlock.outputValue( self.muscleSurface )
 		
@@ -815,11 +765,29 @@ class hrGeneralMuscle( OpenMayaMPx.MPxNode ):
 	
 	
 	def getInputData(self, data, mPointPositions, mUps, mUs, mVs, whichUp):
-		mPointPositions.clear()
-		mUps.clear()
-		mUs.clear()
-		mVs.clear()
-		whichUp.clear()
+		# the cache only holds the current time, evaluations in any other
+		# context (getAttr -time, background evaluation) sample their own
+		if( not data.context().isNormal() ):
+			inputData = self.sampleInputData( data )
+		else:
+			if( self.inputDataCache is None ):
+				self.inputDataCache = self.sampleInputData( data )
+			inputData = self.inputDataCache
+		
+		cachedPositions, cachedUps, cachedUs, cachedVs, cachedWhichUp = inputData
+		mPointPositions.copy( cachedPositions )
+		mUps.copy( cachedUps )
+		mUs.copy( cachedUs )
+		mVs.copy( cachedVs )
+		whichUp.copy( cachedWhichUp )
+	
+	
+	def sampleInputData(self, data):
+		mPointPositions = OpenMaya.MPointArray()
+		mUps = OpenMaya.MVectorArray()
+		mUs = OpenMaya.MVectorArray()
+		mVs = OpenMaya.MVectorArray()
+		whichUp = OpenMaya.MIntArray()
 	
 		tempVec = OpenMaya.MVector()
 		tempVecU = OpenMaya.MVector()
@@ -869,6 +837,8 @@ class hrGeneralMuscle( OpenMayaMPx.MPxNode ):
 	
 			mUs.append(tempVecU)
 			mVs.append(tempVecV)
+		
+		return ( mPointPositions, mUps, mUs, mVs, whichUp )
 	
 	def computeWhichUp(self, plug, data):
 		mPointPositions = OpenMaya.MPointArray()
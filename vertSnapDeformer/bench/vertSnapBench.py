@@ -0,0 +1,519 @@
+##############################################################################
+'''
+vertSnapBench.py
+
+Headless benchmark for the vertSnapDeformer python plugin.
+
+Generates a synthetic driver/driven pair for each requested size, then times
+the bind (vertSnapDeformer.prepareBind: gather the driven points, read the
+driver, search, plus packing the map) and the per-frame deform
+(vertSnapDeformer.deformBulk with a moving driver) separately.  Reports
+throughput and peak memory for each stage, and checks a sample of the bind
+against the brute force getClosestPt() reference.
+
+The maya modules are always replaced by the small stand-ins below (also
+under mayapy), just enough to import the plugin and to run a node's own
+bind and deform code on a stand-in data block and point iterator, so it
+runs on any plain Linux box:
+
+	python vertSnapBench.py
+	python vertSnapBench.py --sizes 1000,10000 --mode grid --radius 0.05
+	python vertSnapBench.py --sizes 100000 --processes 4 --budget 16
+
+The deform stage needs numpy, without it only the bind is timed.
+'''
+##############################################################################
+
+import argparse, array, gc, math, os, random, sys, time, types
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+
+
+#==================================================
+# Maya stand-ins
+#
+# Just enough of OpenMaya for the plugin's own bind and deform code to run
+# on a node with a stand-in data block and geometry iterator.  Point arrays
+# keep their points as an (n, 4) numpy array once numpy is in play, so the
+# bulk copies the plugin makes cost about what they do in Maya.
+class MPoint( object ):
+	def __init__( self, x=0.0, y=0.0, z=0.0, w=1.0 ):
+		self.x = x
+		self.y = y
+		self.z = z
+		self.w = w
+
+	def __mul__( self, matrix ):
+		m = matrix.rows
+		return MPoint( self.x*m[0][0] + self.y*m[1][0] + self.z*m[2][0] + m[3][0],
+					   self.x*m[0][1] + self.y*m[1][1] + self.z*m[2][1] + m[3][1],
+					   self.x*m[0][2] + self.y*m[1][2] + self.z*m[2][2] + m[3][2] )
+
+	def distanceTo( self, other ):
+		dx = self.x - other.x
+		dy = self.y - other.y
+		dz = self.z - other.z
+		return math.sqrt( dx*dx + dy*dy + dz*dz )
+
+
+class MMatrix( object ):
+	def __init__( self, rows=None ):
+		self.rows = rows or [ [1.0, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0], [0.0, 0.0, 1.0, 0.0], [0.0, 0.0, 0.0, 1.0] ]
+		self.matrix = self.rows
+
+	def __call__( self, row, col ):
+		return self.rows[row][col]
+
+	def inverse( self ):
+		import numpy
+		return MMatrix( numpy.linalg.inv( numpy.array( self.rows ) ).tolist() )
+
+
+class Pointer( object ):
+	'''what MScriptUtil.asDouble4Ptr() hands out: int() is the address'''
+	def __init__( self, values ):
+		self.values = values
+
+	def __int__( self ):
+		return self.values.ctypes.data
+
+
+class RawPointer( object ):
+	'''what MFnMesh.getRawPoints() hands out: int() is the address'''
+	def __init__( self, values ):
+		self.values = values
+
+	def __int__( self ):
+		return self.values.buffer_info()[0]
+
+
+class MScriptUtil( object ):
+	def createFromList( self, values, count ):
+		import numpy
+		self.values = numpy.array( values[:count], dtype=numpy.float64 )
+
+	def asDouble4Ptr( self ):
+		return Pointer( self.values )
+
+	@staticmethod
+	def getDouble2ArrayItem( matrix, row, col ):
+		return matrix[row][col]
+
+
+class MPointArray( object ):
+	def __init__( self, points=None, count=None ):
+		self.points = None		# list of MPoints
+		self.coords = None		# or (n, 4) numpy array
+		if( isinstance( points, Pointer ) ):
+			self.coords = points.values[:4 * count].reshape( count, 4 ).copy()
+		elif( isinstance( points, MPointArray ) ):
+			self.copy( points )
+		else:
+			self.points = list( points or [] )
+
+	def copy( self, other ):
+		self.points = None if other.points is None else list( other.points )
+		self.coords = None if other.coords is None else other.coords.copy()
+
+	def length( self ):
+		return len(self.points) if self.coords is None else len(self.coords)
+
+	def listed( self ):
+		if( self.points is None ):
+			self.points = [ MPoint( *p ) for p in self.coords.tolist() ]
+			self.coords = None
+		return self.points
+
+	def packed( self ):
+		if( self.coords is None ):
+			import numpy
+			self.coords = numpy.array( [ (p.x, p.y, p.z, p.w) for p in self.points ] ).reshape( -1, 4 )
+			self.points = None
+		return self
+
+	def __getitem__( self, i ):
+		return self.listed()[i]
+
+	def set( self, i, x, y=None, z=None ):
+		self.listed()[i] = x if y is None else MPoint( x, y, z )
+
+	def append( self, pt ):
+		self.listed().append( pt )
+
+	def get( self, ptr ):
+		ptr.values[:] = self.packed().coords.ravel()
+
+
+class MSpace( object ):
+	kObject = 0
+	kWorld = 1
+
+
+class MObject( object ):
+	'''stand-in for a mesh data object, geometry being an MPointArray'''
+	def __init__( self, geometry=None ):
+		self.geometry = geometry
+
+	def isNull( self ):
+		return self.geometry is None
+
+
+class MObjectHandle( object ):
+	def __init__( self, obj ):
+		self.obj = obj
+
+	def hashCode( self ):
+		return id( self.obj )
+
+
+class MFnMesh( object ):
+	def __init__( self, obj ):
+		self.obj = obj
+
+	def getPoints( self, points, space=MSpace.kObject ):
+		points.copy( self.obj.geometry )
+
+	def numVertices( self ):
+		return self.obj.geometry.length()
+
+	def getRawPoints( self ):
+		#the float32 x, y, z buffer, kept on the data object the way Maya keeps it on the mesh:
+		if( getattr( self.obj, 'raw', None ) is None ):
+			self.obj.raw = array.array( 'f', [ c for p in self.obj.geometry.listed() for c in (p.x, p.y, p.z) ] )
+		return RawPointer( self.obj.raw )
+
+
+class DataHandle( object ):
+	def __init__( self, value ):
+		self.value = value
+
+	def asShort( self ):
+		return int( self.value or 0 )
+	asInt = asShort
+
+	def asFloat( self ):
+		return float( self.value or 0.0 )
+	asDouble = asFloat
+
+	def asBool( self ):
+		return bool( self.value )
+
+	def asMesh( self ):
+		return self.value if self.value is not None else MObject()
+
+	def child( self, attr ):
+		return DataHandle( self.value.get( attr ) )
+
+
+class MArrayDataHandle( object ):
+	'''over a dict of logical index -> value, or a DataHandle holding one'''
+	def __init__( self, elements ):
+		self.elements = elements.value if isinstance( elements, DataHandle ) else elements
+		self.indices = sorted( self.elements or {} )
+		self.current = None
+
+	def elementCount( self ):
+		return len(self.indices)
+
+	def jumpToElement( self, index ):
+		if( index not in self.indices ):
+			raise RuntimeError( 'no element %d' % index )
+		self.current = index
+
+	def jumpToArrayElement( self, k ):
+		self.current = self.indices[k]
+
+	def elementIndex( self ):
+		return self.current
+
+	def inputValue( self ):
+		return DataHandle( self.elements[self.current] )
+
+
+class DataBlock( object ):
+	'''MDataBlock stand-in over a dict of attribute -> value'''
+	def __init__( self, values ):
+		self.values = values
+
+	def inputValue( self, attr ):
+		return DataHandle( self.values.get( attr ) )
+
+	def inputArrayValue( self, attr ):
+		return MArrayDataHandle( self.values.get( attr, {} ) )
+
+
+class PointIterator( object ):
+	'''stand-in for the MItGeometry a deformer gets, over an MPointArray'''
+	def __init__( self, points ):
+		self.points = points
+		self.current = 0
+
+	def isDone( self ):
+		return self.current >= self.points.length()
+
+	def next( self ):
+		self.current += 1
+
+	def reset( self ):
+		self.current = 0
+
+	def index( self ):
+		return self.current
+
+	def count( self ):
+		return self.points.length()
+
+	def position( self ):
+		return self.points[self.current]
+
+	def allPositions( self, points ):
+		points.copy( self.points )
+
+	def setAllPositions( self, points ):
+		self.result = points
+
+
+class _StandIn( object ):
+	'''anything the plugin only touches at import time (MTypeId, attributes, base classes)'''
+	def __init__( self, *args, **kwargs ):
+		pass
+
+
+class _StandInModule( types.ModuleType ):
+	def __getattr__( self, name ):
+		if( name.startswith( '__' ) ):
+			raise AttributeError( name )
+		return _StandIn
+
+
+class _StandInVariables( object ):
+	'''OpenMayaMPx.cvar: one fixed attribute object per name'''
+	def __getattr__( self, name ):
+		value = _StandIn()
+		setattr( self, name, value )
+		return value
+
+
+def installStandIns():
+	maya = _StandInModule( 'maya' )
+	openMaya = _StandInModule( 'maya.OpenMaya' )
+	openMayaMPx = _StandInModule( 'maya.OpenMayaMPx' )
+	cmds = _StandInModule( 'maya.cmds' )
+	utils = _StandInModule( 'maya.utils' )
+	for standIn in ( MPoint, MMatrix, MScriptUtil, MPointArray, MSpace, MObject, MObjectHandle, MFnMesh, MArrayDataHandle ):
+		setattr( openMaya, standIn.__name__, standIn )
+	openMayaMPx.MPxDeformerNode = type( 'MPxDeformerNode', (_StandIn,), {} )
+	openMayaMPx.MPxCommand = type( 'MPxCommand', (_StandIn,), {} )
+	openMayaMPx.cvar = _StandInVariables()
+	maya.OpenMaya = openMaya
+	maya.OpenMayaMPx = openMayaMPx
+	maya.cmds = cmds
+	maya.utils = utils
+	sys.modules.update( { 'maya': maya, 'maya.OpenMaya': openMaya, 'maya.OpenMayaMPx': openMayaMPx, 'maya.cmds': cmds, 'maya.utils': utils } )
+
+
+installStandIns()
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'src' ) )
+import vertSnapDeformer as vsd
+
+OpenMaya = sys.modules['maya.OpenMaya']
+OpenMayaMPx = sys.modules['maya.OpenMayaMPx']
+
+
+#==================================================
+# Synthetic meshes
+def makeMeshes( size, driverRatio, overlap, seed ):
+	'''
+	size driven points scattered in a unit cube, and size * driverRatio driver
+	points.  An overlap share of the driver points sit just off a driven point
+	(a garment snapping to a body), the rest are scattered over the same cube.
+	'''
+	rand = random.Random( seed )
+	driven = [ OpenMaya.MPoint( rand.random(), rand.random(), rand.random() ) for i in range( 0, size ) ]
+	driverCount = max( 1, int(size * driverRatio) )
+	driver = []
+	for i in range( 0, driverCount ):
+		if( rand.random() < overlap ):
+			p = driven[ rand.randrange( size ) ]
+			driver.append( (p.x + rand.gauss( 0.0, 1e-3 ), p.y + rand.gauss( 0.0, 1e-3 ), p.z + rand.gauss( 0.0, 1e-3 )) )
+		else:
+			driver.append( (rand.random(), rand.random(), rand.random()) )
+	return driven, driver
+
+
+#==================================================
+# Measuring
+class Stage( object ):
+	'''
+	Wall clock time and peak memory of one block of work.  The peak is the
+	process high water mark, or with traceMemory the peak of the allocations
+	made inside the block (exact, but it slows python code down a lot).
+	'''
+	def __init__( self, traceMemory=False ):
+		self.traceMemory = traceMemory and tracemalloc is not None
+		self.seconds = 0.0
+		self.peak = 0.0
+
+	def __enter__( self ):
+		gc.collect()
+		if( self.traceMemory ):
+			tracemalloc.start()
+		self.start = time.time()
+		return self
+
+	def __exit__( self, *args ):
+		self.seconds = time.time() - self.start
+		if( self.traceMemory ):
+			self.peak = megabytes( tracemalloc.get_traced_memory()[1] )
+			tracemalloc.stop()
+		else:
+			self.peak = maxResident()
+
+
+def megabytes( count ):
+	return count / (1024.0 * 1024.0)
+
+
+def maxResident():
+	if( resource is None ):
+		return 0.0
+	# kilobytes on linux
+	return resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss / 1024.0
+
+
+#==================================================
+# Stages
+def makeNode( driver, weights, args, radius ):
+	'''a vertSnapDeformer and the data block its bind and deform read'''
+	node = vsd.vertSnapDeformer()
+	cls = vsd.vertSnapDeformer
+	cvar = OpenMayaMPx.cvar
+	data = DataBlock( { cls.bind_mode: 1 if radius > 0 else 0,
+						cls.max_snap_distance: radius,
+						cls.identity_tolerance: 0.001,
+						cls.bind_processes: args.processes,
+						cls.bind_memory_budget: args.budget,
+						cls.num_threads: args.threads,
+						cls.driver_mesh: MObject( MPointArray( [ MPoint( x, y, z ) for (x, y, z) in driver ] ) ),
+						cls.driver_meshes: {},
+						cvar.MPxDeformerNode_weightList: { 0: { cvar.MPxDeformerNode_weights: weights } } } )
+	return node, data
+
+
+def benchBind( node, data, driven ):
+	'''vertSnapDeformer.prepareBind and the search it returns, run in the foreground as initVertMapping does, minus the attribute writes of applyBind'''
+	iter = PointIterator( MPointArray( driven ) )
+	vertMap, surface, snapshot, driverMap = node.prepareBind( data, iter, OpenMaya.MMatrix(), 0, stream=True )( None )
+	return vertMap, snapshot, vsd.packVertMap( vertMap )
+
+
+def checkBind( snapshot, driven, driver, radius, samples, seed ):
+	'''compare a sample of the bind matches against the brute force reference'''
+	getClosestPt = vsd.vertSnapDeformer.__dict__['getClosestPt']
+	points = MPointArray( driven )
+	rand = random.Random( seed )
+	failures = 0
+	for i in range( 0, samples ):
+		d = rand.randrange( len(driver) )
+		pt = OpenMaya.MPoint( *driver[d] )
+		expected = getClosestPt( None, pt, points )
+		if( radius > 0 and pt.distanceTo( points[expected] ) > radius ):
+			expected = -1
+		if( snapshot.matches[d] != expected ):
+			failures += 1
+	return failures
+
+
+def benchDeform( node, data, driven, driver, packed, frames, stage ):
+	'''
+	vertSnapDeformer.deformBulk over frames where the driver moves.  The node
+	deforms once untimed first, which reads the weights and builds the active
+	set, then only the frames are timed.  Each frame hands the node new
+	driver data and dirties its driver plug, as an animated driver would.
+	'''
+	node.vertMapCache = vsd.unpackVertMap( packed )	# what readVertMap() gets off the stored map
+	node.surfaceCache = ()
+	node.driverMapCache = ()
+	drivenPoints = MPointArray( driven ).packed()
+	driverFrames = [ MPointArray( [ MPoint( x + 0.01 * frame, y, z ) for (x, y, z) in driver ] ).packed()
+					 for frame in range( 0, min( frames, 2 ) ) ]
+	localToWorld = OpenMaya.MMatrix()
+	node.deformBulk( data, PointIterator( drivenPoints ), localToWorld, 0, 1.0 )
+
+	with stage:
+		for frame in range( 0, frames ):
+			data.values[vsd.vertSnapDeformer.driver_mesh] = MObject( driverFrames[ frame % len(driverFrames) ] )
+			node.dirtyCaches( vsd.vertSnapDeformer.driver_mesh )
+			node.deformBulk( data, PointIterator( drivenPoints ), localToWorld, 0, 1.0 )
+
+	return node.stats.active
+
+
+#==================================================
+# Main
+def run( args ):
+	radius = args.radius if args.mode == 'grid' else 0.0
+	print( 'vertSnapDeformer bench: mode %s, driver ratio %g, overlap %g, sparsity %g, %d frames, %d threads, %d bind processes, bind budget %d MB%s' %
+		   (args.mode, args.driver_ratio, args.overlap, args.sparsity, args.frames, args.threads, args.processes, args.budget,
+			'' if vsd.numpy is not None else ' (no numpy, deform skipped)') )
+
+	for size in args.sizes:
+		driven, driver = makeMeshes( size, args.driver_ratio, args.overlap, args.seed )
+		rand = random.Random( args.seed )
+		weights = dict( ( i, 0.0 if rand.random() < args.sparsity else rand.random() ) for i in range( 0, size ) )
+		node, data = makeNode( driver, weights, args, radius )
+
+		with Stage( args.trace_memory ) as bind:
+			vertMap, snapshot, packed = benchBind( node, data, driven )
+		mapped = sum( 1 for v in vertMap if v >= 0 )
+		if( snapshot is None ):
+			check = 'check skipped (no snapshot under a memory budget)'
+		else:
+			check = 'check %d/%d failed' % (checkBind( snapshot, driven, driver, radius, args.check, args.seed ), args.check)
+		print( '%8d verts  bind    %9.3f s  %11.0f queries/s  peak %8.1f MB  mapped %d  packed tokens %d  %s' %
+			   (size, bind.seconds, len(driver) / max( bind.seconds, 1e-9 ), bind.peak, mapped, len(packed), check) )
+
+		if( vsd.numpy is not None and args.frames > 0 ):
+			deform = Stage( args.trace_memory )
+			active = benchDeform( node, data, driven, driver, packed, args.frames, deform )
+			perFrame = deform.seconds / args.frames
+			print( '%8d verts  deform  %9.3f ms/frame  %8.0f active verts/s  peak %8.1f MB  active %d' %
+				   (size, perFrame * 1000.0, active / max( perFrame, 1e-9 ), deform.peak, active) )
+
+		for entry in node.driverEntries + [ entry for state in node.deformStates.values() for entry in state.driverEntries.values() ]:
+			vsd.releaseDriver( entry )
+
+	vsd.closeThreadPools()
+	print( 'max resident %.1f MB' % maxResident() )
+
+
+def parseArgs( argv ):
+	parser = argparse.ArgumentParser( description='Time the vertSnapDeformer bind and deform outside of Maya.' )
+	parser.add_argument( '--sizes', default='1000,10000,100000,1000000',
+						 type=lambda s: [ int(v) for v in s.split( ',' ) ], help='driven vertex counts, comma separated' )
+	parser.add_argument( '--driver-ratio', type=float, default=0.5, help='driver verts per driven vert' )
+	parser.add_argument( '--overlap', type=float, default=0.8, help='share of driver verts lying on the driven mesh' )
+	parser.add_argument( '--sparsity', type=float, default=0.5, help='share of driven verts painted to zero weight' )
+	parser.add_argument( '--mode', choices=('closest', 'grid'), default='closest', help='bind search, as the bindMode attribute' )
+	parser.add_argument( '--radius', type=float, default=0.05, help='maxSnapDistance for the grid mode' )
+	parser.add_argument( '--frames', type=int, default=10, help='deform frames to average over' )
+	parser.add_argument( '--threads', type=int, default=1, help='numThreads for the deform, 0 for one per core' )
+	parser.add_argument( '--processes', type=int, default=0, help='bindProcesses for the bind search' )
+	parser.add_argument( '--budget', type=int, default=0, help='bindMemoryBudget for the bind search, in megabytes' )
+	parser.add_argument( '--check', type=int, default=25, help='bind queries checked against the brute force reference' )
+	parser.add_argument( '--trace-memory', action='store_true', help='per stage allocation peaks instead of the process high water mark' )
+	parser.add_argument( '--seed', type=int, default=1 )
+	return parser.parse_args( argv )
+
+
+if __name__ == '__main__':
+	run( parseArgs( sys.argv[1:] ) )
@@ -18,13 +18,25 @@ Description:
 
     vertSnapDeformer();
 
+    To snap many meshes to the same driver, select the driver first and
+    then all of the driven meshes, and run:
 
-Return:     creates & returns a deformer node of "vertSnapDeformer" type.
+    createBatch();
+
+    To snap one mesh to several drivers at once, select the drivers first
+    and the driven mesh last, and run:
+
+    createMulti();
+
+
+Return:     creates & returns a deformer node of "vertSnapDeformer" type
+            (a list of them for createBatch).
 
 """
 import maya.cmds as cmd
 
 __PLUIN_BASENAME__ = 'vertSnapDeformer'
+__PLUGIN_NAME__ = None  # resolved by loadPlugin() on first use
 
 #----------------------------------------------------------------------
 def create():
@@ -41,15 +53,104 @@ def create():
         else:
             defr = cmd.deformer(sel[1], type='vertSnapDeformer')[0]
             cmd.connectAttr('%s.worldMesh[0]' % sel[0], '%s.vertSnapInput' % defr)
-            cmd.setAttr('%s.initialize' % defr, 1)
+            bind(defr)
     else:
         cmd.error("Copy the vertSnapDeformer plugin into the MAYA_PLUGIN_PATH.")
     
     return defr
 
+#----------------------------------------------------------------------
+def createBatch(driver=None, driven=None):
+    """Snap every driven mesh to one driver, in a single undo chunk.
+
+    With no arguments the driver is the first selected object and the
+    driven meshes are the rest of the selection.  All the deformers share
+    the driver's worldMesh connection, so the driver points are read once
+    for all of their binds.
+    """
+    if not loadPlugin():
+        cmd.error("Copy the vertSnapDeformer plugin into the MAYA_PLUGIN_PATH.")
+    
+    if driver is None:
+        sel = cmd.ls(sl=1, ap=1) or []
+        driver, driven = (sel[0], sel[1:]) if sel else (None, [])
+    
+    if driver is None or not driven or not isMesh(driver) or not all(isMesh(obj) for obj in driven):
+        cmd.error(" Select the polygon driver geometry first, and the polygon meshes to be deformed after it.")
+    
+    deformers = []
+    cmd.undoInfo(openChunk=True)
+    try:
+        for obj in driven:
+            defr = cmd.deformer(obj, type='vertSnapDeformer')[0]
+            cmd.connectAttr('%s.worldMesh[0]' % driver, '%s.vertSnapInput' % defr)
+            deformers.append(defr)
+        # bind once every deformer is connected
+        for defr in deformers:
+            bind(defr)
+    finally:
+        cmd.undoInfo(closeChunk=True)
+    
+    return deformers
+
+#----------------------------------------------------------------------
+def createMulti(drivers=None, driven=None):
+    """Snap one driven mesh to several drivers with a single deformer.
+
+    With no arguments the driven mesh is the last selected object and the
+    drivers are the ones selected before it.  The first driver goes into
+    vertSnapInput, the others into vertSnapInputs, and the bind searches
+    them all as one mesh.
+    """
+    if not loadPlugin():
+        cmd.error("Copy the vertSnapDeformer plugin into the MAYA_PLUGIN_PATH.")
+    
+    if driven is None:
+        sel = cmd.ls(sl=1, ap=1) or []
+        drivers, driven = (sel[:-1], sel[-1]) if sel else ([], None)
+    
+    if driven is None or not drivers or not isMesh(driven) or not all(isMesh(obj) for obj in drivers):
+        cmd.error(" Select the polygon driver geometries first, and the polygon mesh to be deformed last.")
+    
+    cmd.undoInfo(openChunk=True)
+    try:
+        defr = cmd.deformer(driven, type='vertSnapDeformer')[0]
+        cmd.connectAttr('%s.worldMesh[0]' % drivers[0], '%s.vertSnapInput' % defr)
+        for i, driver in enumerate(drivers[1:]):
+            cmd.connectAttr('%s.worldMesh[0]' % driver, '%s.vertSnapInputs[%d]' % (defr, i))
+        bind(defr)
+    finally:
+        cmd.undoInfo(closeChunk=True)
+    
+    return defr
+
+#----------------------------------------------------------------------
+def bind(defr):
+    """Bind the deformer and store the map on it right away.
+
+    Setting initialize only asks for a bind once Maya is idle, which batch
+    sessions never are before the next save.  vertSnapBind comes with the
+    python plugin, the compiled plugins store their bind when initialize is set.
+    """
+    if cmd.exists('vertSnapBind'):
+        cmd.vertSnapBind(defr)
+    else:
+        cmd.setAttr('%s.initialize' % defr, 1)
+
+#----------------------------------------------------------------------
+def isMesh(obj):
+    """"""
+    return cmd.nodeType(obj) == 'mesh' or bool(cmd.listRelatives(obj, type='mesh'))
+
 #----------------------------------------------------------------------
 def loadPlugin():
     """"""
+    global __PLUGIN_NAME__
+    if __PLUGIN_NAME__ is not None:
+        if not cmd.pluginInfo(__PLUGIN_NAME__, q=True, l=True):
+            cmd.loadPlugin(__PLUGIN_NAME__)
+        return cmd.pluginInfo(__PLUGIN_NAME__, q=True, l=True)
+    
     mayaVersion = cmd.about(v=1).split(' ')
     
     if cmd.about(os=1) == 'win64':
@@ -65,6 +166,7 @@ def loadPlugin():
         cmd.error('vertSnapDeformer is available for 64bit version of Autodesk Maya 2011 '
                   'or above under Windows 64bit, Mac OS X and Linux 64bit!')
     
+    __PLUGIN_NAME__ = pluginName
     if not cmd.pluginInfo(pluginName, q=True, l=True ):
         cmd.loadPlugin(pluginName)
     
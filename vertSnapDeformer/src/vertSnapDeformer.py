@@ -17,33 +17,1537 @@ NOTE: Tested on Win (32/ 64) and Linux for Maya 8.5, 2008, +
 '''
 ##############################################################################
 
-import math, sys
+import array, bisect, collections, contextlib, ctypes, hashlib, math, mmap, multiprocessing, multiprocessing.pool, os, struct, sys, threading, time, weakref
 
 import maya.cmds
+import maya.utils
 import maya.OpenMaya as OpenMaya
 import maya.OpenMayaMPx as OpenMayaMPx
 
+# numpy is optional, without it deform() falls back to the per-vertex loop
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
 
 kPluginNodeTypeName = "vertSnapDeformer"
+kBindMapCmdName = "vertSnapBindMap"
+kStatsCmdName = "vertSnapStats"
+kBakeCmdName = "vertSnapBake"
+kBindCmdName = "vertSnapBind"
 
 # CHANGE THIS ID AS NEEDED
 vertSnapDeformerID = OpenMaya.MTypeId( 0x7269b )
 
 
+#==================================================
+# Spatial index
+#
+# KDTree, SpatialHash and TriangleBVH live in vertSnapSearch.py next to this
+# file, with no maya imports, so the worker processes of a process pool bind
+# can import them by name.  The plug-in folder is only put on sys.path for that import
+# and while a pool starts its workers.
+kPluginFolder = os.path.dirname( os.path.abspath( __file__ ) )
+
+@contextlib.contextmanager
+def pluginFolderOnPath():
+	added = kPluginFolder not in sys.path
+	if( added ):
+		sys.path.insert( 0, kPluginFolder )
+	try:
+		yield
+	finally:
+		if( added and kPluginFolder in sys.path ):
+			sys.path.remove( kPluginFolder )
+
+with pluginFolderOnPath():
+	from vertSnapSearch import KDTree, SpatialHash, TriangleBVH, bindWorkerInit, bindWorkerChunk
+
+
+def meshTriangles( meshObj ):
+	'''flat vertex index list of the mesh triangulation, three per triangle'''
+	counts = OpenMaya.MIntArray()
+	vertices = OpenMaya.MIntArray()
+	OpenMaya.MFnMesh( meshObj ).getTriangles( counts, vertices )
+	return [ vertices[i] for i in range( 0, vertices.length() ) ]
+
+
+#==================================================
+# Bind repair
+kMaxRepairFraction = 0.25	# above this share of changed driven verts a full rebind is cheaper
+
+def meshSignature( meshObj ):
+	'''
+	What the edit check compares a driven mesh by: its vertex, polygon and
+	face-vertex counts and a sha1 of the float32 points the mesh holds,
+	hashed in place (the counts alone without getRawPoints()).  None for
+	geometry that is not a mesh.
+	'''
+	if( meshObj.isNull() or not meshObj.hasFn( OpenMaya.MFn.kMesh ) ):
+		return None
+	meshFn = OpenMaya.MFnMesh( meshObj )
+	counts = ( meshFn.numVertices(), meshFn.numPolygons(), meshFn.numFaceVertices() )
+	raw = meshRawPoints( meshObj )
+	if( raw is None ):
+		return counts
+	return counts + ( hashlib.sha1( raw ).digest(), )
+
+
+def pointDistance( coords, i, x, y, z ):
+	dx = coords[3*i] - x
+	dy = coords[3*i + 1] - y
+	dz = coords[3*i + 2] - z
+	return math.sqrt( dx*dx + dy*dy + dz*dz )
+
+
+class BindSnapshot( object ):
+	'''
+	What the last bind of one geometry index saw: the world space driven and
+	driver points, the search radius (0 for closest point) and the driven
+	index each driver vertex matched (-1 for none).  Points are flat
+	array('d') buffers, the driver one being the driver cache's own, and the
+	matches an array('i').
+
+	search is the structure the full bind built over the driven points (None
+	when it matched by index), kept so a repair never has to build one over
+	the whole mesh again, about 10 more bytes per driven vertex.  It stays right for every point not in stale: the points the
+	repairs since the full bind found moved, appended or removed.
+
+	repair() uses it to rebind after an edit by only searching again for the
+	driver vertices the edit can affect.
+	'''
+	def __init__( self, drivenPts, driverPts, radius, matches, search=None, stale=() ):
+		self.drivenPts = drivenPts
+		self.driverPts = driverPts
+		self.radius = radius
+		self.matches = array.array( 'i', matches )
+		self.search = search
+		self.stale = set( stale )
+
+
+	def changedPoints( self, drivenPts ):
+		old = self.drivenPts
+		count = len(drivenPts) // 3
+		common = min( count, len(old) // 3 )
+		if( numpy is not None and common ):
+			moved = numpy.frombuffer( drivenPts, dtype=numpy.float64, count=3 * common ).reshape( -1, 3 ) != \
+					numpy.frombuffer( old, dtype=numpy.float64, count=3 * common ).reshape( -1, 3 )
+			changed = numpy.flatnonzero( moved.any( axis=1 ) ).tolist()
+		else:
+			changed = [ i for i in range( 0, common ) if drivenPts[3*i:3*i + 3] != old[3*i:3*i + 3] ]
+		changed.extend( range( common, count ) )	# appended verts
+		return changed
+
+
+	def repair( self, drivenPts, driverPts, radius, makeSearch ):
+		'''
+		Returns the snapshot of the repaired bind, or None when the edit is
+		too large (or changes the driver or radius) and a full bind should
+		run instead.
+
+		A driver vertex whose match and own position did not change only has
+		to be compared against the changed driven points: its old match is
+		still the closest of the untouched ones.  Driver vertices that moved,
+		or whose match moved or was removed, are searched for in the kept
+		search with the stale points left out, and in a small search over the
+		stale points alone.
+		'''
+		if( radius != self.radius or len(driverPts) != len(self.driverPts) ):
+			return None
+		driverMoved = driverPts is not self.driverPts	# the same shared buffer means the same driver state
+
+		count = len(drivenPts) // 3
+		changed = self.changedPoints( drivenPts )
+		removed = max( 0, len(self.drivenPts) // 3 - count )
+		if( len(changed) + removed > kMaxRepairFraction * max( count, 1 ) ):
+			return None
+
+		changedSet = set( changed )
+		changedPts = []
+		for i in changed:
+			changedPts.extend( drivenPts[3*i:3*i + 3] )
+		changedTree = KDTree( changedPts )
+
+		matches = array.array( 'i', self.matches )
+		research = []
+		for d in range( 0, len(driverPts) // 3 ):
+			x, y, z = driverPts[3*d:3*d + 3]
+			old = matches[d]
+			if( (driverMoved and driverPts[3*d:3*d + 3] != self.driverPts[3*d:3*d + 3]) or old >= count or old in changedSet ):
+				research.append( d )
+				continue
+			if( not changed ):
+				continue
+
+			if( old >= 0 ):
+				bestDistance = pointDistance( drivenPts, old, x, y, z )
+			else:
+				bestDistance = radius if radius > 0 else 9e99
+			i = changed[ changedTree.nearest( x, y, z ) ]
+			dist = pointDistance( drivenPts, i, x, y, z )
+			if( dist < bestDistance or (dist == bestDistance and (old < 0 or i < old)) ):
+				matches[d] = i
+
+		if( len(research) > kMaxRepairFraction * max( len(driverPts) // 3, 1 ) ):
+			return None
+		search = self.search
+		stale = set()
+		if( search is None and research ):
+			#the first repair after a bind that kept no search builds it, later ones reuse it:
+			search = makeSearch( drivenPts )
+		elif( search is not None ):
+			limit = max( count, search.count )
+			stale = set( i for i in self.stale | changedSet if i < limit )
+			stale.update( range( count, search.count ) )	# removed verts
+			if( len(stale) > kMaxRepairFraction * max( count, 1 ) ):
+				return None
+			search.coords = drivenPts	# same coordinates as the search was built on, but for the stale points
+
+		if( research ):
+			fresh = sorted( i for i in stale if i < count )
+			freshPts = []
+			for i in fresh:
+				freshPts.extend( drivenPts[3*i:3*i + 3] )
+			freshSearch = makeSearch( freshPts ) if fresh else None
+			for d in research:
+				x, y, z = driverPts[3*d:3*d + 3]
+				best = -1
+				bestDistance = radius if radius > 0 else 9e99
+				candidates = [ search.nearest( x, y, z, stale ) ]
+				if( freshSearch is not None ):
+					j = freshSearch.nearest( x, y, z )
+					candidates.append( fresh[j] if j >= 0 else -1 )
+				for i in candidates:
+					if( i < 0 ):
+						continue
+					dist = pointDistance( drivenPts, i, x, y, z )
+					if( dist < bestDistance or (dist == bestDistance and (best < 0 or i < best)) ):
+						best = i
+						bestDistance = dist
+				matches[d] = best if best >= 0 or radius > 0 else 0
+
+		return BindSnapshot( drivenPts, driverPts, radius, matches, search, stale )
+
+
+#==================================================
+# Identity bind
+kIdentitySamples = 64	# vertices checked before trusting that driver and driven line up
+
+def identityMatches( drivenPts, driverPts, tolerance, makeSearch ):
+	'''
+	For a driver that is a copy of the driven mesh (same count and order),
+	match every driver vertex to the driven vertex with the same index, and
+	only search for the ones further apart than tolerance.  Returns None when
+	the counts differ or a sample of the pairs is already out of tolerance,
+	so the normal search should run instead.
+	'''
+	count = len(drivenPts) // 3
+	if( tolerance <= 0 or count == 0 or len(driverPts) != len(drivenPts) ):
+		return None
+	for i in range( 0, count, max( count // kIdentitySamples, 1 ) ):
+		if( pointDistance( drivenPts, i, driverPts[3*i], driverPts[3*i + 1], driverPts[3*i + 2] ) > tolerance ):
+			return None
+
+	matches = list( range( 0, count ) )
+	failed = [ i for i in range( 0, count ) if pointDistance( drivenPts, i, driverPts[3*i], driverPts[3*i + 1], driverPts[3*i + 2] ) > tolerance ]
+	if( failed ):
+		search = makeSearch( drivenPts )
+		for i in failed:
+			matches[i] = search.nearest( driverPts[3*i], driverPts[3*i + 1], driverPts[3*i + 2] )
+	return matches
+
+
+#==================================================
+# Process pool bind
+kMinDriversPerProcess = 20000	# fewer driver verts than this per process and the pool costs more than it saves
+
+def sharedArray( context, typecode, values ):
+	'''a copy of values in shared memory, handed to the workers at pool start instead of pickled'''
+	if( getattr( values, 'typecode', None ) != typecode ):
+		return context.RawArray( typecode, values )
+	shared = context.RawArray( typecode, len(values) )
+	if( len(values) ):
+		memoryview( shared ).cast( 'B' )[:] = memoryview( values ).cast( 'B' )	# one copy, no per item conversion
+	return shared
+
+
+@contextlib.contextmanager
+def mainModuleHidden():
+	'''
+	A spawned worker imports the parent's __main__ again, by module name or
+	file, before it runs anything.  A mayapy batch script that binds at top
+	level, with no "if __name__ == '__main__'" guard, would run over again
+	in every worker, scene load and bind included.  The workers only need
+	vertSnapSearch, so __main__ goes without its __spec__ and __file__ while
+	the pool starts them, and spawn has nothing of it to import.
+	'''
+	main = sys.modules.get( '__main__' )
+	saved = dict( (name, main.__dict__[name]) for name in ('__spec__', '__file__') if main is not None and name in main.__dict__ )
+	if( '__spec__' in saved ):
+		main.__spec__ = None
+	if( '__file__' in saved ):
+		del main.__file__
+	try:
+		yield
+	finally:
+		for name, value in saved.items():
+			setattr( main, name, value )
+
+
+def bindExecutable():
+	'''
+	Inside the Maya GUI sys.executable is maya itself, point new worker
+	processes at the mayapy next to it instead (bin/ of the app on a Mac).
+	'''
+	folder, name = os.path.split( sys.executable )
+	base, ext = os.path.splitext( name )
+	if( base.lower() == 'maya' ):
+		for path in ( os.path.join( folder, 'mayapy' ), os.path.join( folder, 'mayapy' + ext ),
+					  os.path.join( folder, os.pardir, 'bin', 'mayapy' ) ):
+			if( os.path.isfile( path ) ):
+				return path
+	return sys.executable
+
+
+def parallelNearest( drivenPts, driverPts, radius, processes, search ):
+	'''
+	The bind search with the driver points split into contiguous chunks over
+	a pool of worker processes.  search is the structure the bind built over
+	the driven points, every worker queries it through shared memory and
+	the chunks are merged back in driver order, so the matches are exactly
+	the single process ones.
+
+	The workers are always spawned, never forked: a fork would copy the
+	whole Maya session, threads and all, into each of them.  Spawning needs
+	python 3's start method contexts, and mainModuleHidden() keeps them from
+	running the parent's script again.
+	'''
+	if( not hasattr( multiprocessing, 'get_context' ) ):
+		raise RuntimeError( "process binds need python 3" )
+	from multiprocessing import spawn
+
+	driverCount = len(driverPts) // 3
+	chunks = processes * 4
+	step = max( (driverCount + chunks - 1) // chunks, 1 )
+	spans = [ (lo, min( lo + step, driverCount )) for lo in range( 0, driverCount, step ) ]
+
+	context = multiprocessing.get_context( 'spawn' )
+	flat = search.flatten()
+	if( flat is not None ):
+		flat = dict( ( name, (typecode, sharedArray( context, typecode, values )) ) for name, ( typecode, values ) in flat.items() )
+	initArgs = ( sharedArray( context, 'd', drivenPts ), sharedArray( context, 'd', driverPts ), radius, flat )
+
+	#the executable is a process wide setting, only swap it in while the workers start:
+	executable = spawn.get_executable()
+	with pluginFolderOnPath():
+		with mainModuleHidden():
+			spawn.set_executable( bindExecutable() )
+			try:
+				pool = context.Pool( processes, bindWorkerInit, initArgs )
+			finally:
+				spawn.set_executable( executable )
+	try:
+		results = pool.map( bindWorkerChunk, spans )
+	finally:
+		pool.terminate()
+
+	matches = []
+	for chunk in results:
+		matches.extend( chunk )
+	return matches
+
+
+#==================================================
+# Shared driver cache
+#
+# Entries are keyed on the driver's mesh data object and a generation that
+# goes up whenever a driver plug of any node is dirtied, so a lookup costs
+# no read of the driver.  Nodes evaluating the same driver data in one
+# generation share its points, and whatever search structures were built
+# over them.
+kDriverCacheSize = 8	# unreferenced driver entries kept for reuse, least recently used go first
+
+class DriverEntry( object ):
+	'''
+	World space points of one driver mesh state, shared by every node bound
+	to it, and the search structures built over them so far.
+	'''
+	def __init__( self, key, source, points ):
+		self.key = key
+		self.source = source		# the mesh data, held so its address can't be reused while cached
+		self.points = points		# flat array('d') of x, y, z
+		self.refs = 0
+		self.structures = {}
+		self.lock = threading.Lock()	# held while a structure is built, so others wait for it rather than build it twice
+
+
+	def structure( self, name, build ):
+		'''
+		the structure registered under name, calling build( points ) the first
+		time.  Builds hold this entry's lock, not the cache's, so a long kd-tree
+		or bvh build never blocks a deform acquiring another driver.
+		'''
+		with self.lock:
+			result = self.structures.get( name )
+			if( result is None ):
+				result = build( self.points )
+				self.structures[name] = result
+		return result
+
+
+_driverCache = collections.OrderedDict()	# key -> DriverEntry, least recently used first
+_driverCacheLock = threading.RLock()
+_driverGeneration = 0
+
+def driverChanged():
+	'''a driver plug was dirtied, entries looked up from now on are read again'''
+	global _driverGeneration
+	with _driverCacheLock:
+		_driverGeneration += 1
+		evictDrivers()
+
+
+def extendFromBytes( buf, data ):
+	'''
+	appends the raw bytes of data (bytes, a numpy array) to an array.array and
+	returns it: frombytes() on python 3, fromstring() on python 2
+	'''
+	if( hasattr( buf, 'frombytes' ) ):
+		buf.frombytes( data )
+	else:
+		buf.fromstring( data )
+	return buf
+
+
+def driverPointBuffer( meshObj ):
+	if( numpy is not None ):
+		return extendFromBytes( array.array( 'd' ), numpy.ascontiguousarray( meshWorldPoints( meshObj ) ) )
+
+	pts = OpenMaya.MPointArray()
+	OpenMaya.MFnMesh( meshObj ).getPoints( pts, OpenMaya.MSpace.kWorld )
+	buf = array.array( 'd' )
+	for i in range( 0, pts.length() ):
+		pt = pts[i]
+		buf.extend( (pt.x, pt.y, pt.z) )
+	return buf
+
+
+def driverArray( points ):
+	'''(n, 3) numpy view of a DriverEntry's points, no copy'''
+	return numpy.frombuffer( points, dtype=numpy.float64 ).reshape( -1, 3 )
+
+
+def acquireDriver( meshObj ):
+	'''
+	Returns the shared DriverEntry for the driver mesh data, with its
+	reference count raised, reading its world space points only when no
+	entry of the current generation holds that data.  Pair every call with
+	releaseDriver().
+	'''
+	with _driverCacheLock:
+		key = ( OpenMaya.MObjectHandle( meshObj ).hashCode(), _driverGeneration )
+		entry = _driverCache.pop( key, None )
+		if( entry is None or entry.source != meshObj ):
+			entry = DriverEntry( key, meshObj, driverPointBuffer( meshObj ) )
+		_driverCache[key] = entry
+		entry.refs += 1
+		evictDrivers()
+	return entry
+
+
+def releaseDriver( entry ):
+	with _driverCacheLock:
+		entry.refs -= 1
+		evictDrivers()
+
+
+def evictDrivers():
+	#unused entries of an older generation can't be looked up any more:
+	with _driverCacheLock:
+		for key in [ key for key, entry in _driverCache.items() if entry.refs <= 0 and key[1] != _driverGeneration ]:
+			del _driverCache[key]
+		unused = [ key for key, entry in _driverCache.items() if entry.refs <= 0 ]
+		for key in unused[:max( 0, len(unused) - kDriverCacheSize )]:
+			del _driverCache[key]
+
+
+def clearDriverCache():
+	with _driverCacheLock:
+		_driverCache.clear()
+
+
+#==================================================
+# Bind search
+#
+# The searches only read the python point buffers the node gathered from
+# Maya beforehand, so they can run on a worker thread.  Each returns
+# ( vertMap, surface, snapshot ) for vertSnapDeformer.applyBind().
+kBindProgressStep = 4096	# points searched between progress reports
+
+def searchBind( job, allPts, driverPts, radius, tolerance, processes, snapshot, repairOnly=False ):
+	#repairOnly returns None rather than binding from scratch when the repair can't be done
+	makeSearch = lambda pts: SpatialHash( pts, radius ) if radius > 0 else KDTree( pts )
+
+	#after a small edit only the driver verts it touches are searched again:
+	matches = None
+	if( snapshot is not None ):
+		snapshot = snapshot.repair( allPts, driverPts, radius, makeSearch )
+		if( snapshot is not None ):
+			matches = snapshot.matches
+	if( matches is None and repairOnly ):
+		return None
+
+	#a copy of the driven mesh maps index to index, only the verts that moved get searched:
+	if( matches is None ):
+		matches = identityMatches( allPts, driverPts, min( tolerance, radius ) if radius > 0 else tolerance, makeSearch )
+
+	tree = None
+	if( matches is None ):
+		#build the search structure once, then query it for every driver vert:
+		tree = makeSearch( allPts )
+
+	if( matches is None and processes > 1 and len(driverPts) // 3 >= 2 * kMinDriversPerProcess ):
+		processes = min( processes, len(driverPts) // 3 // kMinDriversPerProcess )
+		try:
+			matches = parallelNearest( allPts, driverPts, radius, processes, tree )
+		except Exception as e:
+			sys.stderr.write( "%s: process bind failed (%s), binding in process\n" % (kPluginNodeTypeName, e) )
+
+	if( matches is None ):
+		driverCount = len(driverPts) // 3
+		matches = []
+		for start in range( 0, driverCount, kBindProgressStep ):
+			if( job is not None ):
+				job.step( float(start) / driverCount )
+			matches.extend( [ tree.nearest( driverPts[3*d], driverPts[3*d + 1], driverPts[3*d + 2] )
+							for d in range( start, min( start + kBindProgressStep, driverCount ) ) ] )
+
+	vertMap = matchesToVertMap( matches, len(allPts) // 3 )
+	if( snapshot is None ):
+		snapshot = BindSnapshot( allPts, driverPts, radius, matches, tree )
+	return ( vertMap, None, snapshot )
+
+
+def matchesToVertMap( matches, count ):
+	#save the closest point mapping to snap verts to each other here:
+	vertMap = array.array( 'i', [-1] ) * count
+	for driverIndex, closest_pt_index in enumerate( matches ):
+		if( 0 <= closest_pt_index < count ):
+			vertMap[ closest_pt_index ] = driverIndex
+	return vertMap
+
+
+def searchSurfaceBind( job, allPts, driverPts, triangles, entry=None ):
+	#closest surface bind: every driven vert maps to its closest point on the driver
+	#triangles, found through a bvh that all nodes bound to this driver state share
+	#(merged drivers have no shared entry, their bvh is built for the one bind):
+	if( entry is None ):
+		bvh = TriangleBVH( driverPts, triangles )
+	else:
+		raw = array.array( 'i', triangles )
+		name = 'triangleBVH:' + hashlib.sha1( raw ).hexdigest()
+		bvh = entry.structure( name, lambda points: TriangleBVH( points, triangles ) )
+
+	count = len(allPts) // 3
+	mapped = array.array( 'i', [-1] ) * count
+	bary = array.array( 'd', [0.0] ) * (2 * count)
+	for i in range( 0, count ):
+		if( job is not None and i % kBindProgressStep == 0 ):
+			job.step( float(i) / count )
+		tri, u, v = bvh.closest( allPts[3*i], allPts[3*i + 1], allPts[3*i + 2] )
+		mapped[i] = tri
+		bary[2*i] = u
+		bary[2*i + 1] = v
+
+	return ( array.array( 'i', [-1] ) * count, ( mapped, bary ), None )	# the repair only knows vertex binds
+
+
+def splitDrivers( result, driverIds, offsets ):
+	'''
+	Adds the driver map to a bind result searched over merged drivers: the
+	merged vertex (or triangle) indices become indices into their own driver,
+	and driverMap holds the driver id per driven vert, None when every vert
+	maps to driver 0.  offsets is where each driver starts in the merge.
+	A None result (a repair that was not done) stays None.
+	'''
+	if( result is None ):
+		return None
+	vertMap, surface, snapshot = result
+	if( driverIds == [0] ):
+		return ( vertMap, surface, snapshot, None )
+
+	merged = surface[0] if surface is not None else vertMap
+	driverMap = array.array( 'i', [0] ) * len(merged)
+	for v in range( 0, len(merged) ):
+		m = merged[v]
+		if( m >= 0 ):
+			k = bisect.bisect_right( offsets, m ) - 1
+			merged[v] = m - offsets[k]
+			driverMap[v] = driverIds[k]
+	return ( vertMap, surface, snapshot, driverMap )
+
+
+#==================================================
+# Streaming bind
+#
+# With a bindMemoryBudget set, the driven points go through the search in
+# budget sized float32 chunks (12 bytes a point rather than three python
+# floats): a search structure per chunk, queried by every driver vert, which
+# keeps its best match so far.  A bind in the foreground reads each chunk
+# off the geometry iterator as the search gets to it, so only one chunk and
+# the 4 byte per vertex map are ever held for the driven mesh.  The drivers
+# are read in place, through the float32 points each mesh already holds,
+# and copied a budget sized block at a time as the search walks them.  A
+# background bind can't touch the iterator from its thread, it gathers the
+# float32 buffer first and walks chunks of that.  Either way the search's
+# working set follows the budget instead of the meshes, at the cost of one
+# pass over the driver verts per chunk.
+kStreamBytesPerPoint = 64	# chunk copy, kd-tree and its build, per driven point
+kMinStreamChunk = 1024
+
+def streamChunkSize( budget ):
+	'''driven points per chunk for a budget in megabytes'''
+	return max( kMinStreamChunk, int( budget * 1024 * 1024 ) // kStreamBytesPerPoint )
+
+
+def meshRawPoints( meshObj ):
+	'''
+	The float32 x, y, z buffer a mesh holds, as a ctypes array over it rather
+	than a copy, or None when MFnMesh has no getRawPoints().  Points of a
+	driver's worldMesh data are already in world space.  Only valid while the
+	data is.
+	'''
+	meshFn = OpenMaya.MFnMesh( meshObj )
+	if( not hasattr( meshFn, 'getRawPoints' ) ):
+		return None
+	count = meshFn.numVertices()
+	if( count == 0 ):
+		return array.array( 'f' )
+	return ( ctypes.c_float * (3 * count) ).from_address( int( meshFn.getRawPoints() ) )
+
+
+def pointChunks( iter, localToWorldMatrix, size ):
+	'''( first point index, float32 world space points ) for each run of up to size points off a geometry iterator'''
+	start = 0
+	chunk = array.array( 'f' )
+	while( iter.isDone() == False ):
+		pt = iter.position() * localToWorldMatrix
+		chunk.extend( (pt.x, pt.y, pt.z) )
+		if( len(chunk) >= 3 * size ):
+			yield start, chunk
+			start += size
+			chunk = array.array( 'f' )
+		iter.next()
+	iter.reset()
+	if( chunk ):
+		yield start, chunk
+
+
+def bufferChunks( coords, size ):
+	'''( first point index, coordinates ) for each run of up to size points of the buffer'''
+	for start in range( 0, len(coords) // 3, size ):
+		yield start, coords[3*start:3*(start + size)]
+
+
+def streamNearest( job, chunks, count, drivers, radius, size ):
+	'''
+	Same matches as searching all count driven points at once (ties still go
+	to the lowest index, since chunks are visited in order and only a closer
+	point replaces a match), -1 for driver verts nothing was found for.
+	drivers are the flat point buffers of every driver, matched as one merged
+	driver without copying them into one, and read size points at a time.
+	'''
+	driverCount = sum( len(driverPts) // 3 for driverPts in drivers )
+	bestIndex = array.array( 'i', [-1] ) * driverCount
+	bestDistance = array.array( 'd', [9e99] ) * driverCount
+	total = max( (count + size - 1) // size, 1 )
+
+	for n, (start, chunk) in enumerate( chunks ):
+		if( job is not None ):
+			job.step( float(n) / total )
+		search = SpatialHash( chunk, radius ) if radius > 0 else KDTree( chunk )
+		first = 0
+		for driverPts in drivers:
+			for lo in range( 0, len(driverPts) // 3, size ):
+				block = driverPts[3*lo:3*(lo + size)]
+				for d in range( 0, len(block) // 3 ):
+					x = block[3*d]
+					y = block[3*d + 1]
+					z = block[3*d + 2]
+					i = search.nearest( x, y, z )
+					if( i < 0 ):
+						continue
+					distance = pointDistance( chunk, i, x, y, z )
+					k = first + lo + d
+					if( distance < bestDistance[k] ):
+						bestDistance[k] = distance
+						bestIndex[k] = start + i
+			first += len(driverPts) // 3
+		search = None
+
+	return bestIndex
+
+
+def searchStreamBind( job, chunks, count, drivers, radius, size ):
+	#a memory budget searches the driven points a chunk at a time, and keeps no snapshot:
+	return ( matchesToVertMap( streamNearest( job, chunks, count, drivers, radius, size ), count ), None, None )
+
+
+#==================================================
+# Dynamic bind
+#
+# The Dynamic bind mode maps every weighted driven vert to its nearest driver
+# vert, and re-resolves that on each evaluation where something moved.  The
+# search starts from the vert the previous evaluation found and walks the
+# driver's edges towards the driven point, so under small motion it only
+# looks at a few verts.  Rows with no previous match, or whose walk runs out
+# of steps, go through one kd-tree over the driver points instead.
+kMaxWalkSteps = 16
+
+def meshAdjacency( meshObj ):
+	'''( offsets, neighbours ) vertex adjacency of a mesh, the neighbours of v being neighbours[offsets[v]:offsets[v + 1]]'''
+	counts = OpenMaya.MIntArray()
+	vertices = OpenMaya.MIntArray()
+	meshFn = OpenMaya.MFnMesh( meshObj )
+	meshFn.getVertices( counts, vertices )
+
+	linked = [ set() for v in range( 0, meshFn.numVertices() ) ]
+	first = 0
+	for f in range( 0, counts.length() ):
+		size = counts[f]
+		for k in range( 0, size ):
+			a = vertices[first + k]
+			b = vertices[first + (k + 1) % size]
+			linked[a].add( b )
+			linked[b].add( a )
+		first += size
+
+	offsets = array.array( 'i', [0] )
+	neighbours = array.array( 'i' )
+	for near in linked:
+		neighbours.extend( sorted( near ) )
+		offsets.append( len(neighbours) )
+	return ( offsets, neighbours )
+
+
+def walkNearest( points, adjacency, start, x, y, z, maxSteps=kMaxWalkSteps ):
+	'''
+	Greedy descent over the mesh edges from vertex start towards (x, y, z):
+	returns the first vertex with nothing closer in its two rings (the second
+	ring gets across quad diagonals), or -1 when getting there takes more
+	than maxSteps moves.  points is a flat [x0, y0, z0, x1, ...] list.
+
+	Such a local minimum is only the nearest vertex when (x, y, z) is close
+	to the mesh there: it is kept when it lies within its longest edge of the
+	point, anything further out could have another part of the mesh nearer,
+	and gets -1 too so the caller asks a kd-tree instead.
+	'''
+	offsets, neighbours = adjacency
+	current = start
+	dx, dy, dz = points[3*start] - x, points[3*start + 1] - y, points[3*start + 2] - z
+	best = dx*dx + dy*dy + dz*dz
+	for step in range( 0, maxSteps + 1 ):
+		nearest = current
+		ring = neighbours[offsets[current]:offsets[current + 1]]
+		for rings in range( 0, 2 ):
+			for n in ring:
+				dx, dy, dz = points[3*n] - x, points[3*n + 1] - y, points[3*n + 2] - z
+				d = dx*dx + dy*dy + dz*dz
+				if( d < best or (d == best and n < nearest) ):
+					nearest = n
+					best = d
+			if( nearest != current ):
+				break
+			ring = [ n2 for n in ring for n2 in neighbours[offsets[n]:offsets[n + 1]] ]
+		if( nearest == current ):
+			cx, cy, cz = points[3*current], points[3*current + 1], points[3*current + 2]
+			reach = 0.0
+			for n in neighbours[offsets[current]:offsets[current + 1]]:
+				dx, dy, dz = points[3*n] - cx, points[3*n + 1] - cy, points[3*n + 2] - cz
+				reach = max( reach, dx*dx + dy*dy + dz*dz )
+			return current if best <= reach else -1
+		current = nearest
+	return -1
+
+
+def searchDynamicBind( job, allPts, driverPts ):
+	#the first dynamic bind: the nearest driver vert of every driven vert
+	count = len(allPts) // 3
+	vertMap = array.array( 'i', [-1] ) * count
+	if( len(driverPts) == 0 ):
+		return ( vertMap, None, None )
+	tree = KDTree( driverPts )
+	for i in range( 0, count ):
+		if( job is not None and i % kBindProgressStep == 0 ):
+			job.step( float(i) / count )
+		vertMap[i] = tree.nearest( allPts[3*i], allPts[3*i + 1], allPts[3*i + 2] )
+	return ( vertMap, None, None )
+
+
+#==================================================
+# Background bind
+
+class BindCancelled( Exception ):
+	pass
+
+
+class BindJob( object ):
+	'''
+	A bind search running on a daemon thread.  search( job ) is one of the
+	searches above with its points bound in; it reports through step(), which
+	is also where a cancel takes effect.  Once it finishes the job goes back
+	to its node through the idle queue, where the map is swapped in.
+	'''
+	def __init__( self, node, mIndex, search ):
+		self.node = weakref.ref( node )
+		self.mIndex = mIndex
+		self.search = search
+		self.progress = 0.0
+		self.cancelled = False
+		self.result = None
+		self.error = None
+		self.seconds = 0.0
+		self.thread = threading.Thread( target=self.run )
+		self.thread.daemon = True
+
+
+	def start( self ):
+		self.thread.start()
+
+
+	def step( self, progress ):
+		if( self.cancelled ):
+			raise BindCancelled()
+		self.progress = progress
+
+
+	def cancel( self ):
+		self.cancelled = True
+
+
+	def run( self ):
+		start = time.time()
+		try:
+			self.result = self.search( self )
+			self.progress = 1.0
+		except BindCancelled:
+			pass
+		except Exception as e:
+			self.error = e
+		self.seconds = time.time() - start
+		maya.utils.executeDeferred( finishBindJob, self )
+
+
+def finishBindJob( job ):
+	node = job.node()
+	if( node is not None ):
+		node.finishBind( job )
+
+
+#==================================================
+# Packed vertex map storage
+def packVertMap( vertMap ):
+	'''
+	Run-length encode a vertex map for the vtxIndexMapPacked attribute.
+
+	The packed form is [count, token, token, ...].  A token >= 0 is a mapped
+	driver index, a token < 0 stands for a run of -token un-mapped (-1)
+	entries, so a lone un-mapped vertex is still stored as -1.  Tokens come
+	back as an array('i'), 4 bytes each.
+	'''
+	if( numpy is not None ):
+		values = numpy.asarray( vertMap, dtype=numpy.int32 )
+		if( len(values) == 0 ):
+			return array.array( 'i', [0] )
+		neg = values < 0
+		prevNeg = numpy.concatenate( ([False], neg[:-1]) )
+		nextNeg = numpy.concatenate( (neg[1:], [False]) )
+		runStarts = numpy.nonzero( neg & ~prevNeg )[0]
+		runEnds = numpy.nonzero( neg & ~nextNeg )[0]
+		keep = ~neg
+		keep[runStarts] = True
+		tokens = values.copy()
+		tokens[runStarts] = runStarts - runEnds - 1
+		return extendFromBytes( array.array( 'i', [ len(values) ] ), numpy.ascontiguousarray( tokens[keep], dtype=numpy.intc ) )
+
+	tokens = array.array( 'i', [ len(vertMap) ] )
+	run = 0
+	for v in vertMap:
+		if( v < 0 ):
+			run += 1
+			continue
+		if( run ):
+			tokens.append( -run )
+			run = 0
+		tokens.append( int(v) )
+	if( run ):
+		tokens.append( -run )
+	return tokens
+
+
+def unpackVertMap( tokens ):
+	'''inverse of packVertMap(), returns a numpy int array when numpy is available, else a list'''
+	if( not tokens ):
+		count = 0
+		tokens = []
+	else:
+		count = tokens[0]
+		tokens = tokens[1:]
+
+	if( numpy is not None ):
+		tokens = numpy.asarray( tokens, dtype=numpy.int64 )
+		vertMap = numpy.repeat( numpy.where( tokens < 0, -1, tokens ), numpy.where( tokens < 0, -tokens, 1 ) )
+		if( len(vertMap) != count ):
+			vertMap = numpy.concatenate( (vertMap[:count], numpy.full( max(count - len(vertMap), 0), -1, dtype=numpy.int64 )) )
+		return vertMap
+
+	vertMap = []
+	for t in tokens:
+		if( t < 0 ):
+			vertMap.extend( [-1] * -t )
+		else:
+			vertMap.append( t )
+	del vertMap[count:]
+	vertMap.extend( [-1] * (count - len(vertMap)) )
+	return vertMap
+
+
+def intArrayFromData( dataObj ):
+	'''list of ints held by an MFnIntArrayData object (empty when the attribute was never set)'''
+	if( dataObj.isNull() ):
+		return []
+	values = OpenMaya.MFnIntArrayData( dataObj ).array()
+	return [ values[i] for i in range( 0, values.length() ) ]
+
+
+def intArrayData( values ):
+	'''
+	new MFnIntArrayData object holding the given ints.  A list goes through
+	MScriptUtil in one call, any other sequence (an array('i'), a mapped
+	buffer) is set into the MIntArray element by element, so it is never
+	copied into a list of python ints.
+	'''
+	intArray = OpenMaya.MIntArray()
+	if( isinstance( values, list ) ):
+		OpenMaya.MScriptUtil.createIntArrayFromList( values, intArray )
+	else:
+		intArray.setLength( len(values) )
+		for i, value in enumerate( values ):
+			intArray.set( value, i )
+	return OpenMaya.MFnIntArrayData().create( intArray )
+
+
+def doubleArrayFromData( dataObj ):
+	if( dataObj.isNull() ):
+		return []
+	values = OpenMaya.MFnDoubleArrayData( dataObj ).array()
+	return [ values[i] for i in range( 0, values.length() ) ]
+
+
+def doubleArrayData( values ):
+	doubleArray = OpenMaya.MDoubleArray()
+	OpenMaya.MScriptUtil.createDoubleArrayFromList( values, doubleArray )
+	return OpenMaya.MFnDoubleArrayData().create( doubleArray )
+
+
+#==================================================
+# Bind map files
+#
+# A bind map file is a 64 byte header followed by the unpacked map as raw
+# little endian int32s, so it can be memory mapped straight back in.  The
+# header carries a fingerprint of the driver and driven meshes it was made
+# from and loading refuses the file when they no longer match.
+kBindMapMagic = b'VSNPMAP\0'
+kBindMapVersion = 3	# 1 fingerprinted a sample of the vertices, 2 every vertex rounded to 1e-4
+kBindMapHeader = struct.Struct( '<8sIIII20s20s' )	# magic, version, map length, driver count, driven count, driver hash, driven hash
+
+
+kFingerprintSamples = 1024	# vertices hashed when the mesh's own point buffer can't be read
+
+
+def meshFingerprint( meshObj ):
+	'''
+	Identity for a mesh: (vertex count, sha1 of its counts and points).  The
+	points are the meshSignature() hash of the float32 buffer the mesh
+	holds, read in place, so no copy of the mesh is made.  Without
+	getRawPoints() kFingerprintSamples evenly spaced vertices are hashed
+	instead, rounded to 1e-4.
+	'''
+	signature = meshSignature( meshObj )
+	if( signature is None ):
+		raise RuntimeError( "bind map files need mesh drivers and driven geometry" )
+	count = signature[0]
+	digest = hashlib.sha1( struct.pack( '<III', *signature[:3] ) )
+	if( len(signature) > 3 ):
+		digest.update( signature[3] )
+	else:
+		meshFn = OpenMaya.MFnMesh( meshObj )
+		pt = OpenMaya.MPoint()
+		for i in range( 0, count, max( 1, count // kFingerprintSamples ) ):
+			meshFn.getPoint( i, pt )
+			digest.update( struct.pack( '<3q', *[ int( math.floor( v * 1e4 + 0.5 ) ) for v in ( pt.x, pt.y, pt.z ) ] ) )
+	return ( count, digest.digest() )
+
+
+def writeBindMapFile( path, vertMap, driverPrint, drivenPrint ):
+	f = open( path, 'wb' )
+	try:
+		f.write( kBindMapHeader.pack( kBindMapMagic, kBindMapVersion, len(vertMap),
+									 driverPrint[0], drivenPrint[0], driverPrint[1], drivenPrint[1] ) )
+		if( numpy is not None ):
+			numpy.asarray( vertMap, dtype='<i4' ).tofile( f )
+		else:
+			values = array.array( 'i', vertMap )
+			if( sys.byteorder != 'little' ):
+				values.byteswap()
+			values.tofile( f )
+	finally:
+		f.close()
+
+
+def readBindMapFile( path, driverPrint, drivenPrint ):
+	'''memory maps a bind map file and returns its map packed for vtxIndexMapPacked'''
+	f = open( path, 'rb' )
+	try:
+		mapped = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+	finally:
+		f.close()
+
+	try:
+		if( len(mapped) < kBindMapHeader.size ):
+			raise RuntimeError( "%s is not a vertSnapDeformer bind map" % path )
+		magic, version, count, driverCount, drivenCount, driverHash, drivenHash = kBindMapHeader.unpack_from( mapped, 0 )
+		if( magic != kBindMapMagic ):
+			raise RuntimeError( "%s is not a vertSnapDeformer bind map" % path )
+		if( version != kBindMapVersion ):
+			raise RuntimeError( "%s was written by another version of vertSnapDeformer, re-bind instead" % path )
+		if( (driverCount, driverHash) != tuple(driverPrint) or (drivenCount, drivenHash) != tuple(drivenPrint) ):
+			raise RuntimeError( "%s was made for different meshes, re-bind instead" % path )
+		if( len(mapped) < kBindMapHeader.size + 4 * count ):
+			raise RuntimeError( "%s is truncated" % path )
+
+		if( numpy is not None ):
+			values = numpy.frombuffer( mapped, dtype='<i4', count=count, offset=kBindMapHeader.size )
+			tokens = packVertMap( values )
+			del values	# release the buffer before the map is closed
+		else:
+			values = extendFromBytes( array.array( 'i' ), mapped[kBindMapHeader.size:kBindMapHeader.size + 4 * count] )
+			if( sys.byteorder != 'little' ):
+				values.byteswap()
+			tokens = packVertMap( values )
+	finally:
+		mapped.close()
+
+	return tokens
+
+
+#==================================================
+# Bake cache files
+#
+# A bake cache is a 32 byte header, the baked frame numbers as float64s, the
+# mapped vertex indices as int32s, then one block of float32 x, y, z object
+# space deltas (deformed - input) per frame for those rows, all little
+# endian.  Frames have a fixed size so the frame table is the index, and
+# playback memory maps the file and only touches the block it needs.
+kBakeMagic = b'VSNPBAK\0'
+kBakeVersion = 1
+kBakeHeader = struct.Struct( '<8sIIII4x' )	# magic, version, vertex count, baked vertex count, frame count
+
+
+def writeBakeHeader( f, count, indices, frames ):
+	f.write( kBakeHeader.pack( kBakeMagic, kBakeVersion, count, len(indices), len(frames) ) )
+	numpy.asarray( frames, dtype='<f8' ).tofile( f )
+	numpy.asarray( indices, dtype='<i4' ).tofile( f )
+
+
+def writeBakeFrame( f, deltas ):
+	numpy.asarray( deltas, dtype='<f4' ).tofile( f )
+
+
+def bakeFileStamp( path ):
+	'''(mtime, size) of a bake cache file, None when it can't be read'''
+	try:
+		info = os.stat( path )
+	except OSError:
+		return None
+	return ( info.st_mtime, info.st_size )
+
+
+class BakeCache( object ):
+	'''
+	Read side of a bake cache file, memory mapped.  deltas( frame ) returns the
+	x, y, z deltas of the baked frame closest to frame, for indices: an
+	(active, 3) view of the file with numpy, flat floats without.  stamp is
+	the file's bakeFileStamp when it was opened, so playback can tell when
+	the file was baked over.
+	'''
+	def __init__( self, path ):
+		self.path = path
+		f = open( path, 'rb' )
+		try:
+			info = os.fstat( f.fileno() )
+			self.stamp = ( info.st_mtime, info.st_size )
+			self.mapped = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+		finally:
+			f.close()
+
+		if( len(self.mapped) < kBakeHeader.size ):
+			raise RuntimeError( "%s is not a vertSnapDeformer bake cache" % path )
+		magic, version, self.count, active, frameCount = kBakeHeader.unpack_from( self.mapped, 0 )
+		if( magic != kBakeMagic or version != kBakeVersion ):
+			raise RuntimeError( "%s is not a vertSnapDeformer bake cache" % path )
+		self.indicesOffset = kBakeHeader.size + 8 * frameCount
+		self.dataOffset = self.indicesOffset + 4 * active
+		self.frameSize = 12 * active
+		if( len(self.mapped) < self.dataOffset + self.frameSize * frameCount ):
+			raise RuntimeError( "%s is truncated" % path )
+
+		self.frames = list( struct.unpack_from( '<%dd' % frameCount, self.mapped, kBakeHeader.size ) )
+		self.indices = list( struct.unpack_from( '<%di' % active, self.mapped, self.indicesOffset ) )
+		self.rows = None	# iteration row per index, filled in by the first playback
+		self.present = None	# with numpy: which indices have a row
+
+
+	def frameIndex( self, frame ):
+		k = bisect.bisect_left( self.frames, frame )
+		if( k == len(self.frames) or (k > 0 and frame - self.frames[k-1] <= self.frames[k] - frame) ):
+			k -= 1
+		return k
+
+
+	def deltas( self, frame ):
+		offset = self.dataOffset + self.frameSize * self.frameIndex( frame )
+		if( numpy is not None ):
+			return numpy.frombuffer( self.mapped, dtype='<f4', count=3 * len(self.indices), offset=offset ).reshape( -1, 3 )
+		return struct.unpack_from( '<%df' % (3 * len(self.indices)), self.mapped, offset )
+
+
+	def close( self ):
+		self.mapped.close()
+
+
+#==================================================
+# Bulk deform helpers (numpy only)
+def matrixToArray( matrix ):
+	'''copy an MMatrix into a 4x4 numpy array (row vector convention, like MPoint * MMatrix)'''
+	return numpy.array( [ [ OpenMaya.MScriptUtil.getDouble2ArrayItem( matrix.matrix, r, c ) for c in range(4) ] for r in range(4) ] )
+
+
+kPooledPointBuffers = 4	# idle point buffers kept for the next evaluation
+
+_pointBuffers = collections.OrderedDict()	# point count -> idle buffers, least recently used first
+_pointBuffersLock = threading.Lock()
+
+@contextlib.contextmanager
+def pointBuffer( count ):
+	'''
+	( MScriptUtil, double4 pointer, (count, 4) numpy view ) over one block of
+	count points.  MPointArray copies in and out of it in C++, so moving a
+	whole mesh between Maya and numpy runs no python per point.  Filling a
+	new MScriptUtil takes a python list of 4 * count floats, so buffers go
+	back to a small pool for the next evaluation instead.
+	'''
+	with _pointBuffersLock:
+		idle = _pointBuffers.get( count )
+		buffer = idle.pop() if idle else None
+	if( buffer is None ):
+		util = OpenMaya.MScriptUtil()
+		util.createFromList( [0.0] * (4 * count), 4 * count )
+		ptr = util.asDouble4Ptr()
+		view = numpy.ctypeslib.as_array( (ctypes.c_double * (4 * count)).from_address( int( ptr ) ) )
+		buffer = ( util, ptr, view.reshape( count, 4 ) )
+	try:
+		yield buffer
+	finally:
+		with _pointBuffersLock:
+			_pointBuffers.setdefault( count, [] ).append( buffer )
+			_pointBuffers[count] = _pointBuffers.pop( count )
+			while( sum( len(idle) for idle in _pointBuffers.values() ) > kPooledPointBuffers ):
+				idle = next( iter( _pointBuffers.values() ) )
+				idle.pop( 0 )
+				if( not idle ):
+					_pointBuffers.popitem( last=False )
+
+
+def pointsToArray( points ):
+	'''copy an MPointArray into an (n, 4) array, w included'''
+	if( points.length() == 0 ):
+		return numpy.empty( (0, 4) )
+	with pointBuffer( points.length() ) as ( util, ptr, view ):
+		points.get( ptr )
+		return view.copy()
+
+
+def arrayToPoints( coords ):
+	'''an MPointArray of the (n, 4) coords'''
+	if( len(coords) == 0 ):
+		return OpenMaya.MPointArray()
+	with pointBuffer( len(coords) ) as ( util, ptr, view ):
+		view[:] = coords
+		return OpenMaya.MPointArray( ptr, len(coords) )
+
+
+def meshWorldPoints( meshObj ):
+	'''(n, 3) world space points of a mesh'''
+	points = OpenMaya.MPointArray()
+	OpenMaya.MFnMesh( meshObj ).getPoints( points, OpenMaya.MSpace.kWorld )
+	return pointsToArray( points )[:, :3]
+
+
+def transformPoints( pts, matrix ):
+	'''
+	(n, 3) points * 4x4 matrix, summed in the same order as MPoint * MMatrix.
+	Plain element-wise math rather than a BLAS product, so every row comes
+	out bit-identical however the array is chunked.
+	'''
+	return pts[:, 0:1] * matrix[0, :3] + pts[:, 1:2] * matrix[1, :3] + pts[:, 2:3] * matrix[2, :3] + matrix[3, :3]
+
+
+def snapBlend( drivenPts, targetPts, weights, localToWorld, worldToLocal ):
+	'''
+	Batched version of the per-vertex snap in vertSnapDeformer.deform.
+
+	drivenPts are object space and targetPts world space (n, 3) arrays,
+	weights is (n,) and already includes the envelope.  Returns the blended
+	points back in object space.
+	'''
+	world = transformPoints( drivenPts, localToWorld )
+	world += (targetPts - world) * weights[:, None]
+	return transformPoints( world, worldToLocal )
+
+
+class DeformState( object ):
+	'''
+	What vertSnapDeformer keeps between evaluations for one geometry index:
+	the iteration order, the painted weights and the last input and output
+	points, so a paint stroke only re-deforms the vertices it touched, and a
+	driver that was re-evaluated without moving re-deforms nothing.
+	'''
+	def __init__( self ):
+		self.indices = None			# vertex index per iteration row
+		self.rowOf = None			# vertex index -> row, None when they are the same
+		self.weights = None			# painted weight per row
+		self.dirtyWeights = set()	# vertex indices whose weight plug was dirtied since the last evaluation
+		self.vertMap = None			# bind map that mapped was built from
+		self.mapped = None			# driver index per row (driver triangle for a surface bind)
+		self.driverMap = None		# driver map that driverIds was built from
+		self.driverIds = None		# driver id per row
+		self.multiDriver = False	# driverIds is not all driver 0
+		self.bary = None			# (rows, 2) barycentric u, v per row for a surface bind, else None
+		self.drivers = None			# driver id -> (verts, 3) world points, or ( points, (triangles, 3) corners ) for a surface bind
+		self.driverEntries = {}		# driver id -> shared DriverEntry the points are a view of
+		self.inputPoints = None		# (rows, 4) un-deformed points of the last full evaluation
+		self.outputPoints = None	# (rows, 4) deformed points of the last evaluation
+		self.env = None
+		self.localToWorld = None
+		self.stale = True			# the geometry or bind changed, no incremental update
+		self.driverDirty = True		# the driver was re-evaluated, compare it against targets
+		self.targets = None			# world space driver points of the active rows, last full evaluation
+
+		# active set: the rows with a non-zero weight and a valid mapped driver index,
+		# rebuilt only when the weights, the bind or the driver vertex counts change
+		self.activeRows = None
+		self.activeDriver = None
+		self.activeIds = None
+		self.activeWeights = None
+		self.limits = None			# vertex (or triangle) count per driver id, plus a 0 for missing ids
+
+
+	def row( self, index ):
+		if( self.rowOf is None ):
+			return index if index < len(self.indices) else -1
+		return self.rowOf.get( index, -1 )
+
+
+	def updateActive( self, limits ):
+		limits = numpy.asarray( list( limits ) + [ 0 ], dtype=numpy.int64 )
+		if( self.activeRows is not None and numpy.array_equal( limits, self.limits ) ):
+			return
+		self.limits = limits
+		valid = (self.weights != 0) & self.mappedRows( self.mapped, self.driverIds )
+		self.activeRows = numpy.nonzero( valid )[0]
+		self.activeDriver = self.mapped[self.activeRows]
+		self.activeIds = self.driverIds[self.activeRows]
+		self.activeWeights = self.weights[self.activeRows]
+		self.targets = None
+
+
+	def mappedRows( self, mapped, ids ):
+		#mask of the rows whose index lies inside their (connected) driver:
+		return (mapped >= 0) & (mapped < self.limits[numpy.minimum( ids, len(self.limits) - 1 )])
+
+
+#==================================================
+# Threaded deform
+kMinRowsPerThread = 4096	# below this a chunk costs more to dispatch than to compute
+
+_threadPools = {}
+_threadPoolsLock = threading.Lock()	# nodes deforming in parallel can ask for a pool at the same time
+
+def threadPool( threads ):
+	'''worker pool for the given thread count, created on first use and kept for the session'''
+	with _threadPoolsLock:
+		pool = _threadPools.get( threads )
+		if( pool is None ):
+			pool = multiprocessing.pool.ThreadPool( threads )
+			_threadPools[threads] = pool
+	return pool
+
+
+def closeThreadPools():
+	with _threadPoolsLock:
+		for pool in _threadPools.values():
+			pool.terminate()
+		_threadPools.clear()
+
+
+def runChunks( work, count, threads ):
+	'''
+	Calls work( lo, hi ) over contiguous row chunks of range( count ) on a
+	thread pool.  numpy releases the GIL inside its gathers, element-wise math
+	and scatters, so the chunks run concurrently as long as they write
+	disjoint rows.  Rows never depend on each other, so the result is the
+	same for any thread count.  threads == 0 uses one thread per core.
+
+	The pool is keyed on the requested thread count, so every mesh size
+	shares it, and a small mesh gets fewer chunks rather than its own pool.
+	'''
+	if( threads == 0 ):
+		threads = multiprocessing.cpu_count()
+	chunks = min( threads, count // kMinRowsPerThread )
+	if( chunks <= 1 ):
+		work( 0, count )
+		return
+
+	bounds = [ (count * k) // chunks for k in range( 0, chunks + 1 ) ]
+	threadPool( threads ).map( lambda span: work( span[0], span[1] ), zip( bounds[:-1], bounds[1:] ) )
+
+
+#==================================================
+# Performance counters
+class NodeStats( object ):
+	'''
+	What one vertSnapDeformer reports through the vertSnapStats command.
+	Times are in seconds, the deform time leaves out any bind that ran in the
+	same evaluation.
+	'''
+	def __init__( self ):
+		self.reset()
+
+
+	def reset( self ):
+		self.bindSeconds = 0.0
+		self.deformSeconds = 0.0
+		self.mapped = 0
+		self.active = 0
+		self.evaluations = 0
+
+
+	def values( self ):
+		return [ self.bindSeconds, self.deformSeconds, self.mapped, self.active, self.evaluations ]
+
+
+def mappedCount( vertMap ):
+	if( numpy is not None and isinstance( vertMap, numpy.ndarray ) ):
+		return int( numpy.count_nonzero( vertMap >= 0 ) )
+	return sum( 1 for v in vertMap if v >= 0 )
+
+
+_nodeRegistry = weakref.WeakValueDictionary()	# asHashable( node ) -> vertSnapDeformer, for the commands
+
+def findNode( nodeObj ):
+	'''the python vertSnapDeformer behind a node MObject, or None'''
+	return _nodeRegistry.get( OpenMayaMPx.asHashable( OpenMaya.MFnDependencyNode( nodeObj ).userNode() ) )
+
+
+_sceneCallbacks = []
+
+def storePendingBinds( clientData=None ):
+	#binds deform asked for run from the idle queue, which batch sessions never
+	#get to, so run and store whatever is still pending before a save.
+	#nodes of older scenes move their per-element map to the packed one here too:
+	for node in list( _nodeRegistry.values() ):
+		if( node.needsBind and node.bindJob is None ):
+			try:
+				node.bind( False )
+			except RuntimeError as e:
+				sys.stderr.write( "%s: bind failed (%s)\n" % (kPluginNodeTypeName, e) )
+		if( node.pendingTokens is not None ):
+			node.storeBind()
+		else:
+			node.migrateLegacyMap()
+
+
 #==================================================
 # Node definition
 class vertSnapDeformer( OpenMayaMPx.MPxDeformerNode ):
 	#----------------------------------------
 	# class variables
 	driver_mesh = OpenMaya.MObject()		# driver object (the one the verts will snap to)
+	driver_meshes = OpenMaya.MObject()		# more drivers, vertSnapInputs[i] is driver i + 1
+	driver_map_packed = OpenMaya.MObject()	# packed driver id per driven vert, empty when all snap to driver 0
 	initialized_data = OpenMaya.MObject()	# allows the vert mapping to be reset
 	vert_map = OpenMaya.MObject()  # this is the array of associated vert indexes (interal node use)	
+	vert_map_packed = OpenMaya.MObject()	# run-length packed vert_map, what the node stores and reads now
+	num_threads = OpenMaya.MObject()	# deform thread count, 1 = single threaded, 0 = one per core
+	bind_mode = OpenMaya.MObject()	# closest point or grid radius bind
+	max_snap_distance = OpenMaya.MObject()	# grid radius bind search radius
+	playback = OpenMaya.MObject()	# play the bake cache back instead of deforming
+	cache_file = OpenMaya.MObject()	# bake cache written by vertSnapBake
+	time_data = OpenMaya.MObject()	# current time, for the cache playback
+	bind_processes = OpenMaya.MObject()	# worker processes for the bind search, 0 or 1 binds in process
+	identity_tolerance = OpenMaya.MObject()	# same count meshes closer than this bind index to index, 0 turns it off
+	background_bind = OpenMaya.MObject()	# Re-Set Bind searches on a worker thread, the old map deforms meanwhile
+	bind_memory_budget = OpenMaya.MObject()	# megabytes the bind search may work in, 0 searches all points at once
+	surface_triangles = OpenMaya.MObject()	# packed driver triangle per driven vert, closest surface bind
+	surface_weights = OpenMaya.MObject()	# barycentric u, v per driven vert, closest surface bind
 	
 	
 	#==================================================
 	# constructor
 	def __init__(self):
 		OpenMayaMPx.MPxDeformerNode.__init__(self)
+		self.vertMapCache = None	# unpacked vtxIndexMapPacked, reset when the plug is dirtied
+		self.deformStates = {}		# DeformState per geometry index
+		self.bindSnapshots = {}		# BindSnapshot per geometry index, for repairing the bind after edits
+		self.driverEntries = []		# shared DriverEntry per driver the last bind used
+		self.driverMapCache = None	# unpacked vtxDriverMapPacked, () when every vert maps to driver 0
+		self.stats = NodeStats()
+		self.bakeCache = None		# open BakeCache for playback
+		self.pendingTokens = None	# packed map of a finished bind, not stored on the node yet
+		self.pendingSurface = None	# and its packed surface triangles and weights
+		self.pendingDrivers = None	# and its packed driver map
+		self.surfaceCache = None	# ( driver triangle per vert, flat u, v per vert ), None when not surface bound
+		self.triangleCache = {}		# driver id -> ( ( vertex count, polygon count ), triangles ) for the deform, (T, 3) with numpy
+		self.adjacencyCache = {}	# driver id -> ( ( vertex count, polygon count ), adjacency ) for the dynamic bind
+		self.needsBind = False		# deform asked for a bind (or a repair) that has not run yet
+		self.bindScheduled = False	# and bind() is on the idle queue for it
+		self.bindSignature = None	# ( meshSignature of the driven mesh, driver vertex counts ) the last bind saw
+		self.editCheckScheduled = False	# checkEdits() is on the idle queue
+		self.bindJob = None			# BindJob searching in the background, if any
+	
+	
+	def postConstructor(self):
+		_nodeRegistry[ OpenMayaMPx.asHashable( self ) ] = self
+	
+	
+	#deform only reads its inputs and never sets plugs, so nodes can evaluate in parallel:
+	if( hasattr( OpenMayaMPx.MPxNode, 'kParallel' ) ):
+		def schedulingType(self):
+			return OpenMayaMPx.MPxNode.kParallel
+	
+	
+	def __del__(self):
+		if( self.bindJob is not None ):
+			self.bindJob.cancel()
+		self.closeBakeCache()
+		for entry in self.driverEntries:
+			releaseDriver( entry )
+		self.driverEntries = []
+		for state in self.deformStates.values():
+			for entry in state.driverEntries.values():
+				releaseDriver( entry )
+			state.driverEntries = {}
+	
+	
+	#==================================================
+	# setDependentsDirty
+	# keeps the deform caches honest: a dirtied weight element only marks that
+	# vertex for re-reading, anything else that feeds the result drops the
+	# cached points
+	def setDependentsDirty( self, plug, plugArray ):
+		if( plug == OpenMayaMPx.cvar.MPxDeformerNode_weights and plug.isElement() ):
+			state = self.deformStates.get( plug.array().parent().logicalIndex() )
+			if( state is not None ):
+				state.dirtyWeights.add( plug.logicalIndex() )
+		elif( plug == OpenMayaMPx.cvar.MPxDeformerNode_weights ):
+			state = self.deformStates.get( plug.parent().logicalIndex() )
+			if( state is not None ):
+				state.weights = None
+		else:
+			self.dirtyCaches( plug.attribute() )
+
+		return OpenMayaMPx.MPxDeformerNode.setDependentsDirty( self, plug, plugArray )
+	
+	
+	# the evaluation manager (Maya 2016+) evaluates without calling setDependentsDirty,
+	# it calls this before each evaluation of the node instead.  Dirty weight elements
+	# are walked one by one, so a brush stroke only re-reads the verts it painted:
+	def preEvaluation( self, context, evaluationNode ):
+		weights = OpenMayaMPx.cvar.MPxDeformerNode_weights
+		weightList = OpenMayaMPx.cvar.MPxDeformerNode_weightList
+		if( evaluationNode.dirtyPlugExists( weights ) or evaluationNode.dirtyPlugExists( weightList ) ):
+			self.dirtyWeightPlugs( evaluationNode )
+
+		for attr in self.cachedInputs():
+			if( attr != weights and attr != weightList and evaluationNode.dirtyPlugExists( attr ) ):
+				self.dirtyCaches( attr )
+	
+	
+	def dirtyWeightPlugs( self, evaluationNode ):
+		#same as setDependentsDirty() for every dirty weight plug: an element marks its
+		#vertex, a geometry's whole weights re-reads that geometry, weightList all of them:
+		plugs = evaluationNode.iterator()
+		while( not plugs.isDone() ):
+			plug = plugs.plug()
+			plugs.next()
+			if( plug == OpenMayaMPx.cvar.MPxDeformerNode_weights and plug.isElement() ):
+				state = self.deformStates.get( plug.array().parent().logicalIndex() )
+				if( state is not None ):
+					state.dirtyWeights.add( plug.logicalIndex() )
+			elif( plug == OpenMayaMPx.cvar.MPxDeformerNode_weights or
+				  (plug == OpenMayaMPx.cvar.MPxDeformerNode_weightList and plug.isElement()) ):
+				geometry = plug.parent() if plug == OpenMayaMPx.cvar.MPxDeformerNode_weights else plug
+				state = self.deformStates.get( geometry.logicalIndex() )
+				if( state is not None ):
+					state.weights = None
+			elif( plug == OpenMayaMPx.cvar.MPxDeformerNode_weightList ):
+				self.dirtyCaches( plug.attribute() )
+	
+	
+	def cachedInputs( self ):
+		#every attribute dirtyCaches() drops something for:
+		return ( self.vert_map_packed, self.vert_map, self.surface_triangles, self.surface_weights, self.driver_map_packed,
+				 OpenMayaMPx.cvar.MPxDeformerNode_weights, OpenMayaMPx.cvar.MPxDeformerNode_weightList,
+				 OpenMayaMPx.cvar.MPxDeformerNode_groupId, OpenMayaMPx.cvar.MPxDeformerNode_inputGeom,
+				 OpenMayaMPx.cvar.MPxDeformerNode_input, self.initialized_data, self.driver_mesh, self.driver_meshes,
+				 self.bind_mode )
+	
+	
+	def dirtyCaches( self, attr ):
+		if( attr == self.vert_map_packed or attr == self.vert_map ):
+			self.vertMapCache = None
+		elif( attr == self.surface_triangles or attr == self.surface_weights ):
+			self.surfaceCache = None
+		elif( attr == self.driver_map_packed ):
+			self.driverMapCache = None
+
+		elif( attr == self.bind_mode ):
+			#Dynamic re-resolves the mapped rows in place, rebuild them from the stored maps:
+			for state in self.deformStates.values():
+				state.vertMap = None
+
+		elif( attr == OpenMayaMPx.cvar.MPxDeformerNode_weights or attr == OpenMayaMPx.cvar.MPxDeformerNode_weightList ):
+			for state in self.deformStates.values():
+				state.weights = None
+
+		elif( attr == OpenMayaMPx.cvar.MPxDeformerNode_groupId ):
+			for state in self.deformStates.values():
+				state.indices = None
+
+		elif( attr == OpenMayaMPx.cvar.MPxDeformerNode_inputGeom or attr == OpenMayaMPx.cvar.MPxDeformerNode_input or
+			  attr == self.initialized_data ):
+			for state in self.deformStates.values():
+				state.stale = True
+			if( attr != self.initialized_data ):
+				self.requestEditCheck()
+
+		elif( attr == self.driver_mesh or attr == self.driver_meshes ):
+			driverChanged()
+			for state in self.deformStates.values():
+				state.driverDirty = True
+			self.requestEditCheck()
 	
 	
 	
@@ -54,15 +1558,41 @@ class vertSnapDeformer( OpenMayaMPx.MPxDeformerNode ):
 	#==================================================
 	# deform
 	def deform( self, data, iter, localToWorldMatrix, mIndex ):
+		start = time.time()
+		self.deformGeometry( data, iter, localToWorldMatrix, mIndex )
+		self.stats.deformSeconds = time.time() - start
+		self.stats.evaluations += 1
+
+
+	def deformGeometry( self, data, iter, localToWorldMatrix, mIndex ):
+		if( data.inputValue( self.playback ).asBool() ):
+			if( mIndex == 0 ):
+				self.deformFromCache( data, iter )
+			return
+
 		initialized_mapping = data.inputValue( self.initialized_data ).asShort();
 		
 		#//////////////////////////////////////
 		#/ Attribute based initializing for resetting the deform state:
 		#/ (using an attr on the node)
 		#/
+		#/ The bind never runs here: deform only reads the stored map, so its
+		#/ output is a function of the plugs alone.  Re-Set Bind asks for a bind
+		#/ from the idle queue, bind() searches and stores it outside of compute,
+		#/ and the Bound it sets re-evaluates the node.  Until then the node
+		#/ deforms with the map it has stored, if any.
+		#/
 		if( initialized_mapping == 1 ):
-			self.initVertMapping(data, iter, localToWorldMatrix, mIndex)
-			initialized_mapping = data.inputValue( self.initialized_data ).asShort()
+			if( mIndex == 0 ):
+				self.requestBind()
+			if( not len(self.readVertMap( data )) ):
+				return	#// nothing stored yet, the output stays a copy of the input
+			initialized_mapping = 2
+		elif( initialized_mapping == 2 and mIndex == 0 and iter.count() != len(self.readVertMap( data ))):
+			#the driven topology changed under the bind, ask for a repair of the map
+			#(there is one map per node, made for geometry 0 like the bake).
+			#Edits that keep the count are caught by checkEdits():
+			self.requestBind()
 	
 		if( initialized_mapping == 2 ):  # //deformer data initialized successfully. begin deform.
 	
@@ -70,15 +1600,30 @@ class vertSnapDeformer( OpenMayaMPx.MPxDeformerNode ):
 			envelope = OpenMayaMPx.cvar.MPxDeformerNode_envelope
 			envelopeHandle = data.inputValue( envelope )
 			env = envelopeHandle.asFloat()
+			if( env == 0 ):
+				self.stats.active = 0
+				return	#// nothing moves, the output is already a copy of the input
 			
-			vertMapArrayData  = data.inputArrayValue( self.vert_map )
-			
-			# attach to the poly function set :
-			meshAttrHandle = data.inputValue( self.driver_mesh )
-			meshMobj = OpenMaya.MObject()
+			if( numpy is not None ):
+				self.deformBulk( data, iter, localToWorldMatrix, mIndex, env )
+				return
 			
-			meshMobj = meshAttrHandle.asMesh()
-			vertIter = OpenMaya.MItMeshVertex( meshMobj )
+			vertMap = self.readVertMap( data )
+			driverMap = self.readDriverMap( data )
+			surface = self.readSurfaceMap( data )
+			if( surface is not None ):
+				#surface bind: vertMap becomes the driver triangle, snapped to the barycentric point
+				vertMap, bary = surface
+			worldToLocalMatrix = localToWorldMatrix.inverse()
+			active = 0
+
+			#world space points (and triangles) of every connected driver, by driver id:
+			drivers = {}
+			for driverId, driverMesh in self.driverMeshes( data ):
+				driverPts = OpenMaya.MPointArray()
+				OpenMaya.MFnMesh( driverMesh ).getPoints( driverPts, OpenMaya.MSpace.kWorld )
+				triangles = self.driverTriangles( driverId, driverMesh ) if surface is not None else None
+				drivers[driverId] = ( driverPts, triangles )
 			
 			
 			# this is the deform loop:
@@ -86,83 +1631,825 @@ class vertSnapDeformer( OpenMayaMPx.MPxDeformerNode ):
 				weight = self.weightValue( data, mIndex, iter.index() ) #//painted weight
 				ww = weight * env; #//weight * envelope value
 					
-				if ( ww != 0 ): #// filter out weights that are  zero
-					vertMapArrayData.jumpToElement( iter.index() )
-					index_mapped = vertMapArrayData.inputValue().asInt() #//get mapped index
-					if( index_mapped >= 0 ): #// filter out un-mapped points
-						util = OpenMaya.MScriptUtil()   
-						prevInt = util.asIntPtr()   
-					
-						vertIter.setIndex( index_mapped, prevInt )
-						
-						mappedPt = OpenMaya.MPoint()
-						mappedPt = vertIter.position( OpenMaya.MSpace.kWorld )	#// get in world space
-					
+				if ( ww != 0 and iter.index() < len(vertMap) ): #// filter out weights that are  zero
+					index_mapped = vertMap[ iter.index() ] #//get mapped index
+					driverPts, triangles = drivers.get( driverMap[ iter.index() ] if driverMap else 0, ( None, None ) )
+					mappedPt = None
+					if( driverPts is None or index_mapped < 0 ): #// filter out un-mapped points
+						pass
+					elif( surface is not None and index_mapped < len(triangles) // 3 ):
+						u = bary[ 2*iter.index() ]
+						v = bary[ 2*iter.index() + 1 ]
+						a = driverPts[ triangles[3*index_mapped] ]
+						b = driverPts[ triangles[3*index_mapped + 1] ]
+						c = driverPts[ triangles[3*index_mapped + 2] ]
+						mappedPt = OpenMaya.MPoint( a.x + u*(b.x - a.x) + v*(c.x - a.x),
+													a.y + u*(b.y - a.y) + v*(c.y - a.y),
+													a.z + u*(b.z - a.z) + v*(c.z - a.z) )
+					elif( surface is None and index_mapped < driverPts.length() ):
+						mappedPt = driverPts[ index_mapped ]	#// already in world space
+
+					if( mappedPt is not None ):
+						active += 1
 						iterPt = OpenMaya.MPoint()
 						iterPt = iter.position() * localToWorldMatrix 	#// get in world space by transforming
 						
 						pt = OpenMaya.MPoint()
 						pt = iterPt + ((mappedPt - iterPt) * ww )		#// scale delta for painted weights
-						pt = pt * localToWorldMatrix.inverse() 				#// transform new pt back into obj space
+						pt = pt * worldToLocalMatrix 				#// transform new pt back into obj space
 						iter.setPosition( pt )									#// set the point on the deforming mesh.
 				
 				iter.next()
+			self.stats.active = active
 
 
-	def initVertMapping( self, data, iter, localToWorldMatrix, mIndex):
-		#make poly mesh function set object:
-		meshAttrHandle = data.inputValue( self.driver_mesh  )
-		meshMobj = meshAttrHandle.asMesh()
-		vertIter = OpenMaya.MItMeshVertex( meshMobj )
-		vertIter.reset()
-		count = iter.count()
-		
-		vertMapOutArrayData = data.outputArrayValue( self.vert_map )
-		
-		vertMapOutArrayBuilder = OpenMaya.MArrayDataBuilder( self.vert_map, count )
-		allPts = OpenMaya.MPointArray()
-		allPts.clear()
-		
-		i = 0
-		#first initialize all mappings to -1, and also store a buffer pt array to search through:
+	#==================================================
+	# deformBulk
+	# same result as the deform loop above, but with one bulk read and one bulk
+	# write of the geometry and the blend done as a single numpy pass
+	def deformBulk( self, data, iter, localToWorldMatrix, mIndex, env ):
+		state = self.deformState( mIndex )
+		self.updateIndices( iter, state )
+		changedRows = self.updateWeights( data, mIndex, state )
+		self.updateMapped( data, state )
+		localToWorld = matrixToArray( localToWorldMatrix )
+
+		#every connected driver by id, with the vertex (or triangle) count its rows may map into:
+		state.drivers = {}
+		limits = []
+		dynamic = data.inputValue( self.bind_mode ).asShort() == 3 and state.bary is None
+		adjacency = {}
+		entries = {}
+		for driverId, driverMesh in self.driverMeshes( data ):
+			if( dynamic ):
+				adjacency[driverId] = self.driverAdjacency( driverId, driverMesh )
+			entries[driverId] = acquireDriver( driverMesh )
+			driverPts = entries[driverId].structure( 'points', driverArray )
+			if( state.bary is not None ):
+				#surface bind: mapped is a driver triangle, targets are barycentric points
+				triangles = self.driverTriangles( driverId, driverMesh )
+				state.drivers[driverId] = ( driverPts, triangles )
+				count = len(triangles)
+			else:
+				state.drivers[driverId] = driverPts
+				count = len(driverPts)
+			limits.extend( [0] * (driverId + 1 - len(limits)) )
+			limits[driverId] = count
+		for entry in state.driverEntries.values():
+			releaseDriver( entry )
+		state.driverEntries = entries
+		if( dynamic and ( changedRows is None or len(changedRows) or state.stale or state.driverDirty or
+						  not numpy.array_equal( localToWorld, state.localToWorld ) ) ):
+			self.resolveDynamic( iter, state, localToWorld, adjacency, entries )
+		state.updateActive( limits )
+		self.stats.active = len(state.activeRows)
+
+		threads = data.inputValue( self.num_threads ).asInt()
+		full = changedRows is None or state.stale or env != state.env or not numpy.array_equal( localToWorld, state.localToWorld )
+		targets = None
+		if( not full and state.driverDirty ):
+			#the driver was re-evaluated, but it only matters if the points the active rows snap to moved:
+			targets = self.gatherTargets( state, state.activeRows, state.activeDriver, state.activeIds, threads )
+			full = state.targets is None or not numpy.array_equal( targets, state.targets )
+		state.driverDirty = False
+
+		if( not full ):
+			#only painted weights changed since the last evaluation (if anything), redo just those rows:
+			points = state.outputPoints
+			targets = None
+			ww = state.weights[changedRows] * env
+			mapped = state.mapped[changedRows]
+			ids = state.driverIds[changedRows]
+			active = (ww != 0) & state.mappedRows( mapped, ids )
+			reset = changedRows[~active]
+			points[reset] = state.inputPoints[reset]
+			rows = changedRows[active]
+			driverIndices = mapped[active]
+			driverIds = ids[active]
+			ww = ww[active]
+
+		else:
+			if( len(state.activeRows) == 0 ):
+				state.stale = True	# nothing cached, the output is just the input
+				return
+			positions = OpenMaya.MPointArray()
+			iter.allPositions( positions )
+			state.inputPoints = pointsToArray( positions )
+			points = state.inputPoints.copy()
+			state.outputPoints = points
+			state.env = env
+			state.localToWorld = localToWorld
+			state.stale = False
+			rows = state.activeRows
+			driverIndices = state.activeDriver
+			driverIds = state.activeIds
+			ww = state.activeWeights * env	#//weight * envelope value
+
+		if( len(rows) == 0 ):
+			iter.setAllPositions( arrayToPoints( points ) )
+			return
+
+		worldToLocal = matrixToArray( localToWorldMatrix.inverse() )
+		if( targets is None ):
+			targets = self.gatherTargets( state, rows, driverIndices, driverIds, threads )
+		if( full ):
+			state.targets = targets
+		#full weight everywhere, the result is just the driver points in object space:
+		snapOnly = numpy.all( ww == 1.0 )
+
+		def deformChunk( lo, hi ):
+			chunk = rows[lo:hi]
+			if( snapOnly ):
+				result = transformPoints( targets[lo:hi], worldToLocal )
+			else:
+				result = snapBlend( state.inputPoints[chunk, :3], targets[lo:hi], ww[lo:hi], localToWorld, worldToLocal )
+			points[chunk, :3] = result
+			points[chunk, 3] = 1.0
+
+		runChunks( deformChunk, len(rows), threads )
+		iter.setAllPositions( arrayToPoints( points ) )
+
+
+	def gatherTargets( self, state, rows, mapped, ids, threads ):
+		#targetPoints() in row chunks on the deform threads:
+		targets = numpy.empty( (len(rows), 3) )
+		def gatherChunk( lo, hi ):
+			targets[lo:hi] = self.targetPoints( state, rows[lo:hi], mapped[lo:hi], ids[lo:hi] )
+		runChunks( gatherChunk, len(rows), threads )
+		return targets
+
+
+	def targetPoints( self, state, rows, mapped, ids ):
+		#world space points the given rows snap to, mapped being their driver vertex or triangle:
+		if( not state.multiDriver ):
+			return self.driverTargets( state, state.drivers[0], rows, mapped )
+		targets = numpy.empty( (len(rows), 3) )
+		for driverId in numpy.unique( ids ).tolist():
+			pick = ids == driverId
+			targets[pick] = self.driverTargets( state, state.drivers[driverId], rows[pick], mapped[pick] )
+		return targets
+
+
+	def driverTargets( self, state, driver, rows, mapped ):
+		if( state.bary is None ):
+			return driver[mapped]
+		points, triangles = driver
+		corners = triangles[mapped]
+		a = points[corners[:, 0]]
+		u = state.bary[rows, 0:1]
+		v = state.bary[rows, 1:2]
+		return a + u * (points[corners[:, 1]] - a) + v * (points[corners[:, 2]] - a)
+
+
+	def driverMeshes( self, data ):
+		#( driver id, mesh ) of every connected driver, vertSnapInput being driver 0:
+		drivers = [ ( 0, data.inputValue( self.driver_mesh ).asMesh() ) ]
+		arrayHandle = data.inputArrayValue( self.driver_meshes )
+		for k in range( 0, arrayHandle.elementCount() ):
+			arrayHandle.jumpToArrayElement( k )
+			drivers.append( ( arrayHandle.elementIndex() + 1, arrayHandle.inputValue().asMesh() ) )
+		return [ driver for driver in drivers if not driver[1].isNull() ]
+
+
+	def resolveDynamic( self, iter, state, localToWorld, adjacency, entries ):
+		#dynamic bind: moves every weighted row to the nearest vert of its driver,
+		#walking from the one it had, and drops the active set built on the old ones.
+		#the flat coords and fallback kd-tree of a driver state are built once and
+		#shared through its DriverEntry:
+		rows = numpy.nonzero( state.weights != 0 )[0]
+		points = OpenMaya.MPointArray()
+		iter.allPositions( points )
+		world = transformPoints( pointsToArray( points )[rows, :3], localToWorld ).tolist()
+		mapped = state.mapped[rows].tolist()
+		ids = state.driverIds[rows].tolist()
+
+		coords = dict( ( driverId, entry.structure( 'coords', lambda points: points.tolist() ) )
+					   for driverId, entry in entries.items() )
+		misses = []
+		for k in range( 0, len(rows) ):
+			driver = coords.get( ids[k] )
+			found = -1
+			if( driver is not None and 0 <= mapped[k] < len(driver) // 3 ):
+				x, y, z = world[k]
+				found = walkNearest( driver, adjacency[ids[k]], mapped[k], x, y, z )
+			if( found < 0 ):
+				misses.append( k )
+			mapped[k] = found
+
+		if( misses and coords ):
+			#the rows the walk could not place (or place for sure) take the nearest vert over every driver,
+			#ties going to the lowest driver id like one tree over the merged points:
+			driverIds = sorted( coords )
+			trees = [ entries[driverId].structure( 'kdTree', KDTree ) for driverId in driverIds ]
+			for k in misses:
+				x, y, z = world[k]
+				bestDistance = 9e99
+				for driverId, tree in zip( driverIds, trees ):
+					if( tree.count == 0 ):
+						continue
+					m = tree.nearest( x, y, z )
+					dist = pointDistance( coords[driverId], m, x, y, z )
+					if( dist < bestDistance ):
+						bestDistance = dist
+						mapped[k] = m
+						ids[k] = driverId
+
+		state.mapped[rows] = mapped
+		state.driverIds[rows] = ids
+		state.multiDriver = bool( state.driverIds.any() )
+		state.activeRows = None
+
+
+	def driverAdjacency( self, driverId, meshMobj ):
+		#driver vertex adjacency, re-read when its vertex or polygon count changes:
+		meshFn = OpenMaya.MFnMesh( meshMobj )
+		key = ( meshFn.numVertices(), meshFn.numPolygons() )
+		cached = self.adjacencyCache.get( driverId )
+		if( cached is None or cached[0] != key ):
+			cached = ( key, meshAdjacency( meshMobj ) )
+			self.adjacencyCache[driverId] = cached
+		return cached[1]
+
+
+	def driverTriangles( self, driverId, meshMobj ):
+		#driver triangulation, re-read when its vertex or polygon count changes.
+		#a (T, 3) int array for deformBulk with numpy, else the flat list for the loop:
+		meshFn = OpenMaya.MFnMesh( meshMobj )
+		key = ( meshFn.numVertices(), meshFn.numPolygons() )
+		cached = self.triangleCache.get( driverId )
+		if( cached is None or cached[0] != key ):
+			triangles = meshTriangles( meshMobj )
+			if( numpy is not None ):
+				triangles = numpy.array( triangles, dtype=numpy.int64 ).reshape( -1, 3 )
+			cached = ( key, triangles )
+			self.triangleCache[driverId] = cached
+		return cached[1]
+
+
+	#==================================================
+	# deformFromCache
+	# playback: input points plus the baked deltas of the current frame
+	def deformFromCache( self, data, iter ):
+		path = data.inputValue( self.cache_file ).asString()
+		if( not path ):
+			return
+		if( self.bakeCache is None or self.bakeCache.path != path or self.bakeCache.stamp != bakeFileStamp( path ) ):
+			self.closeBakeCache()
+			self.bakeCache = BakeCache( path )
+
+		cache = self.bakeCache
+		if( cache.rows is None ):
+			rowOf = {}
+			while( iter.isDone() == False ):
+				rowOf[ iter.index() ] = len(rowOf)
+				iter.next()
+			iter.reset()
+			if( rowOf and max( rowOf ) >= cache.count ):
+				raise RuntimeError( "%s was baked for a mesh with %d vertices" % (path, cache.count) )
+			cache.rows = [ rowOf.get( index, -1 ) for index in cache.indices ]
+			if( numpy is not None ):
+				rows = numpy.array( cache.rows, dtype=int )
+				cache.present = numpy.flatnonzero( rows >= 0 )
+				cache.rows = rows[cache.present]
+		deltas = cache.deltas( data.inputValue( self.time_data ).asTime().asUnits( OpenMaya.MTime.uiUnit() ) )
+
+		points = OpenMaya.MPointArray()
+		iter.allPositions( points )
+		if( numpy is not None ):
+			coords = pointsToArray( points )
+			coords[cache.rows, :3] += deltas[cache.present]
+			points = arrayToPoints( coords )
+		else:
+			for k, r in enumerate( cache.rows ):
+				if( r >= 0 ):
+					pt = points[r]
+					points.set( r, pt.x + deltas[3*k], pt.y + deltas[3*k + 1], pt.z + deltas[3*k + 2] )
+		iter.setAllPositions( points )
+		self.stats.active = len(cache.rows)
+
+
+	def closeBakeCache( self ):
+		'''drop the playback mapping, before the file is written over or the node goes'''
+		if( self.bakeCache is not None ):
+			self.bakeCache.close()
+			self.bakeCache = None
+
+
+	def deformState( self, mIndex ):
+		state = self.deformStates.get( mIndex )
+		if( state is None ):
+			state = DeformState()
+			self.deformStates[mIndex] = state
+		return state
+
+
+	def updateIndices( self, iter, state ):
+		#vertex index of every iteration row, only re-read when the membership changes:
+		if( state.indices is not None and len(state.indices) == iter.count() ):
+			return
+
+		indices = []
 		while( iter.isDone() == False ):
-			initIndexDataHnd = vertMapOutArrayBuilder.addElement( i )
-			negIndex = -1
-			
-			initIndexDataHnd.setInt( negIndex )
-			initIndexDataHnd.setClean()
-			
-			
-			allPts.append( iter.position() * localToWorldMatrix )
-			i = i+1
+			indices.append( iter.index() )
 			iter.next()
-			
-		vertMapOutArrayData.set( vertMapOutArrayBuilder )
-		
-		while( vertIter.isDone() == False ):
-			driver_pt = OpenMaya.MPoint()
-			driver_pt = vertIter.position( OpenMaya.MSpace.kWorld )
-			closest_pt_index = self.getClosestPt( driver_pt, allPts )
-			#save the closest point mapping to snap verts to each other here:
-			
-			snapDataHnd = vertMapOutArrayBuilder.addElement( closest_pt_index )
-			snapDataHnd.setInt( vertIter.index() )
-			
-			snapDataHnd.setClean()
-			vertIter.next()
-		
-		vertMapOutArrayData.set( vertMapOutArrayBuilder )
-	
-		tObj  =  self.thisMObject()
-		
-		setInitMode = OpenMaya.MPlug( tObj, self.initialized_data  )
-		setInitMode.setShort( 2 ) 
-	
-		iter.reset() #important, reset the geom iterator so it starts from zero again
+		iter.reset()
+
+		state.indices = numpy.array( indices, dtype=numpy.int64 )
+		if( indices == list( range( 0, len(indices) ) ) ):
+			state.rowOf = None
+		else:
+			state.rowOf = dict( zip( indices, range( 0, len(indices) ) ) )
+		state.weights = None
+		state.mapped = None
+		state.activeRows = None
+		state.stale = True
+
+
+	def updateWeights( self, data, mIndex, state ):
+		#painted weights per row, re-reading only the ones dirtied since the last evaluation.
+		#returns the rows that changed, or None when everything was re-read:
+		if( state.weights is None ):
+			state.weights = self.readWeights( data, mIndex, state )
+			state.dirtyWeights.clear()
+			state.activeRows = None
+			return None
+
+		changedRows = []
+		for index in sorted( state.dirtyWeights ):
+			r = state.row( index )
+			if( r >= 0 ):
+				weight = self.weightValue( data, mIndex, index )
+				if( weight != state.weights[r] ):
+					state.weights[r] = weight
+					changedRows.append( r )
+		state.dirtyWeights.clear()
+		if( changedRows ):
+			state.activeRows = None
+		return numpy.array( changedRows, dtype=numpy.int64 )
+
+
+	def readWeights( self, data, mIndex, state ):
+		#weight per row from one pass over the weight elements that exist,
+		#unpainted verts have no element and keep the default of 1:
+		weights = numpy.ones( len(state.indices) )
+		weightList = data.inputArrayValue( OpenMayaMPx.cvar.MPxDeformerNode_weightList )
+		try:
+			weightList.jumpToElement( mIndex )
+		except RuntimeError:
+			return weights
+		handle = OpenMaya.MArrayDataHandle( weightList.inputValue().child( OpenMayaMPx.cvar.MPxDeformerNode_weights ) )
+		rows = []
+		values = []
+		for k in range( 0, handle.elementCount() ):
+			handle.jumpToArrayElement( k )
+			r = state.row( handle.elementIndex() )
+			if( r >= 0 ):
+				rows.append( r )
+				values.append( handle.inputValue().asFloat() )
+		weights[rows] = values
+		return weights
+
+
+	def updateMapped( self, data, state ):
+		#driver index (or triangle) per row, rebuilt when the bind map changes:
+		surface = self.readSurfaceMap( data )
+		vertMap = surface[0] if surface is not None else self.readVertMap( data )
+		driverMap = self.readDriverMap( data )
+		if( state.mapped is not None and state.vertMap is vertMap and state.driverMap is driverMap ):
+			return
+
+		indices = state.indices
+		state.mapped = numpy.full( len(indices), -1, dtype=numpy.int64 )
+		inMap = indices < len(vertMap)
+		state.mapped[inMap] = vertMap[indices[inMap]]
+		state.driverIds = numpy.zeros( len(indices), dtype=numpy.int64 )
+		if( driverMap is not None ):
+			inDriverMap = indices < len(driverMap)
+			state.driverIds[inDriverMap] = driverMap[indices[inDriverMap]]
+		state.multiDriver = bool( state.driverIds.any() )
+		state.driverMap = driverMap
+		state.bary = None
+		if( surface is not None ):
+			state.bary = numpy.zeros( (len(indices), 2) )
+			state.bary[inMap] = surface[1][indices[inMap]]
+		state.vertMap = vertMap
+		state.activeRows = None
+		state.stale = True
+
+
+	#==================================================
+	# readVertMap
+	# returns the bind map indexed by vertex id (-1 = un-mapped), unpacked
+	# from vtxIndexMapPacked and cached until that plug is dirtied
+	def readVertMap( self, data ):
+		if( self.vertMapCache is None ):
+			tokens = intArrayFromData( data.inputValue( self.vert_map_packed ).data() )
+			if( tokens ):
+				self.vertMapCache = unpackVertMap( tokens )
+			else:
+				#scenes saved before the packed map still have the per-element multi,
+				#the next save or stored bind moves it over:
+				self.vertMapCache = self.readLegacyVertMap( data )
+			#a surface bind stores an all -1 vertex map, its triangle map says what is mapped:
+			surface = self.readSurfaceMap( data )
+			self.stats.mapped = mappedCount( surface[0] if surface is not None else self.vertMapCache )
+		return self.vertMapCache
+
+
+	def readSurfaceMap( self, data ):
+		#( driver triangle per vert, u, v per vert ) of a closest surface bind, or None:
+		if( self.surfaceCache is None ):
+			tokens = intArrayFromData( data.inputValue( self.surface_triangles ).data() )
+			if( tokens and tokens[0] ):
+				bary = doubleArrayFromData( data.inputValue( self.surface_weights ).data() )
+				if( numpy is not None ):
+					bary = numpy.asarray( bary ).reshape( -1, 2 )
+				self.surfaceCache = ( unpackVertMap( tokens ), bary )
+				self.stats.mapped = mappedCount( self.surfaceCache[0] )
+			else:
+				self.surfaceCache = ()
+		return self.surfaceCache or None
+
+
+	def readDriverMap( self, data ):
+		#driver id per vert, None when every vert maps to driver 0:
+		if( self.driverMapCache is None ):
+			tokens = intArrayFromData( data.inputValue( self.driver_map_packed ).data() )
+			self.driverMapCache = unpackVertMap( tokens ) if tokens and tokens[0] else ()
+		return self.driverMapCache if len(self.driverMapCache) else None
+
+
+	def readLegacyVertMap( self, data ):
+		vertMapArrayData = data.inputArrayValue( self.vert_map )
+		vertMap = []
+		for k in range( 0, vertMapArrayData.elementCount() ):
+			vertMapArrayData.jumpToArrayElement( k )
+			index = vertMapArrayData.elementIndex()
+			if( index >= len(vertMap) ):
+				vertMap.extend( [-1] * (index + 1 - len(vertMap)) )
+			vertMap[index] = vertMapArrayData.inputValue().asInt()
+
+		if( numpy is not None ):
+			return numpy.array( vertMap, dtype=numpy.int64 )
+		return vertMap
+
+
+	def writeVertMap( self, vertMap, surface=None, driverMap=None ):
+		#packs a new bind for storeBind(), deform only sees it once it is on the plugs.
+		#a surface bind passes ( triangle per vert, flat u, v per vert ) and an all -1 vertMap,
+		#a bind over several drivers passes the driver id per vert:
+		self.pendingTokens = packVertMap( vertMap )
+		if( surface is not None ):
+			self.pendingSurface = ( packVertMap( surface[0] ), list( surface[1] ) )
+		else:
+			self.pendingSurface = ( [], [] )
+		self.pendingDrivers = packVertMap( driverMap ) if driverMap is not None else []
+
+
+	#==================================================
+	# storeBind
+	# writes a new bind to vtxIndexMapPacked and sets the node to Bound, from
+	# outside of any compute
+	def storeBind( self ):
+		tokens = self.pendingTokens
+		if( tokens is None ):
+			return
+		try:
+			node = self.thisMObject()
+			OpenMaya.MPlug( node, self.vert_map_packed ).setMObject( intArrayData( tokens ) )
+			if( self.pendingSurface is not None ):
+				OpenMaya.MPlug( node, self.surface_triangles ).setMObject( intArrayData( self.pendingSurface[0] ) )
+				OpenMaya.MPlug( node, self.surface_weights ).setMObject( doubleArrayData( self.pendingSurface[1] ) )
+			if( self.pendingDrivers is not None ):
+				OpenMaya.MPlug( node, self.driver_map_packed ).setMObject( intArrayData( self.pendingDrivers ) )
+
+			self.dropLegacyMap( node )
+			OpenMaya.MPlug( node, self.initialized_data ).setShort( 2 )
+		except RuntimeError:
+			return	# the node went away before the idle queue got to it
+		self.pendingTokens = None
+		self.pendingSurface = None
+		self.pendingDrivers = None
+
+
+	def dropLegacyMap( self, node ):
+		#drop the old per-element map so it is no longer saved with the scene:
+		legacyPlug = OpenMaya.MPlug( node, self.vert_map )
+		if( legacyPlug.numElements() ):
+			nodeName = OpenMaya.MFnDependencyNode( node ).name()
+			indices = OpenMaya.MIntArray()
+			legacyPlug.getExistingArrayAttributeIndices( indices )
+			for k in range( 0, indices.length() ):
+				maya.cmds.removeMultiInstance( '%s.vtxIndexMap[%d]' % (nodeName, indices[k]), b=True )
+
+
+	def migrateLegacyMap( self ):
+		#a scene saved before the packed map keeps its per-element vtxIndexMap until the
+		#node is rebound, so the save moves it to vtxIndexMapPacked, leaving the bind state alone:
+		try:
+			node = self.thisMObject()
+			if( not OpenMaya.MPlug( node, self.vert_map ).numElements() ):
+				return
+			packedPlug = OpenMaya.MPlug( node, self.vert_map_packed )
+			packed = packedPlug.asMObject()
+			if( packed.isNull() or not OpenMaya.MFnIntArrayData( packed ).length() ):
+				packedPlug.setMObject( intArrayData( packVertMap( storedVertMap( node ) ) ) )
+			self.dropLegacyMap( node )	# (with a packed map already stored the elements are unused)
+		except RuntimeError:
+			return	# the node went away
+
+
+	def timedBind( self, data, iter, localToWorldMatrix, mIndex, repair=False ):
+		start = time.time()
+		self.initVertMapping( data, iter, localToWorldMatrix, mIndex, repair )
+		self.stats.bindSeconds = time.time() - start
+		return self.stats.bindSeconds
+
+
+	def initVertMapping( self, data, iter, localToWorldMatrix, mIndex, repair=False ):
+		search = self.prepareBind( data, iter, localToWorldMatrix, mIndex, stream=True, repair=repair )
+		result = search( None ) if search is not None else None
+		if( result is not None ):
+			self.applyBind( mIndex, result )
+
+
+	def prepareBind( self, data, iter, localToWorldMatrix, mIndex, stream=False, repair=False ):
+		#gathers everything the bind needs from Maya and returns the search to run on it.
+		#stream says the search runs right away, on this thread, so under a memory budget
+		#it can read the driven points off iter as it goes.  repair only repairs the last
+		#bind, the search returns None (and without a snapshot to repair, so does this)
+		#where a full bind would be needed:
+		bindMode = data.inputValue( self.bind_mode ).asShort()
+		budget = data.inputValue( self.bind_memory_budget ).asInt()
+		chunkSize = streamChunkSize( budget ) if budget > 0 else 0
+		if( repair and (bindMode not in (0, 1) or chunkSize or mIndex not in self.bindSnapshots) ):
+			return None
+		drivers = self.driverMeshes( data )
+		driverIds = [ driverId for driverId, driverMesh in drivers ]
+
+		#a vertex bind under a memory budget run right here reads its chunks straight off iter,
+		#and the drivers' points where the meshes hold them, without a copy of either mesh:
+		streamed = chunkSize and bindMode in (0, 1)
+		if( streamed and stream ):
+			driverBuffers = [ meshRawPoints( driverMesh ) for driverId, driverMesh in drivers ]
+			if( None not in driverBuffers ):
+				radius = self.bindRadius( data )
+				offsets = [ 0 ]
+				for driverPts in driverBuffers:
+					offsets.append( offsets[-1] + len(driverPts) // 3 )
+				count = iter.count()
+				chunks = pointChunks( iter, localToWorldMatrix, chunkSize )
+				return lambda job: splitDrivers( searchStreamBind( job, chunks, count, driverBuffers, radius, chunkSize ),
+												driverIds, offsets[:-1] )
+
+		#every node bound to the same driver state shares one world space point buffer:
+		entries = [ acquireDriver( driverMesh ) for driverId, driverMesh in drivers ]
+		for entry in self.driverEntries:
+			releaseDriver( entry )
+		self.driverEntries = entries
+		pointOffsets = [ 0 ]
+		for entry in entries:
+			pointOffsets.append( pointOffsets[-1] + len(entry.points) // 3 )
+
+		#a buffer pt array of the driven mesh to search through, float32 under a memory budget:
+		if( chunkSize ):
+			allPts = array.array( 'f' )
+			for start, chunk in pointChunks( iter, localToWorldMatrix, chunkSize ):
+				allPts.extend( chunk )
+		elif( numpy is not None ):
+			#one bulk read, moved to world space in numpy:
+			positions = OpenMaya.MPointArray()
+			iter.allPositions( positions )
+			world = transformPoints( pointsToArray( positions )[:, :3], matrixToArray( localToWorldMatrix ) )
+			allPts = extendFromBytes( array.array( 'd' ), numpy.ascontiguousarray( world ) )
+		else:
+			allPts = array.array( 'd' )
+			while( iter.isDone() == False ):
+				pt = iter.position() * localToWorldMatrix
+				allPts.extend( (pt.x, pt.y, pt.z) )
+				iter.next()
+			iter.reset() #important, reset the geom iterator so it starts from zero again
+
+		if( streamed ):
+			radius = self.bindRadius( data )
+			driverBuffers = [ entry.points for entry in entries ]
+			count = len(allPts) // 3
+			return lambda job: splitDrivers( searchStreamBind( job, bufferChunks( allPts, chunkSize ), count, driverBuffers, radius, chunkSize ),
+											driverIds, pointOffsets[:-1] )
+
+		#several drivers are searched as one merged mesh, split back up by splitDrivers():
+		if( len(entries) == 1 ):
+			driverPts = entries[0].points
+		else:
+			driverPts = array.array( 'd' )
+			for entry in entries:
+				driverPts.extend( entry.points )
+
+		if( bindMode == 2 ):
+			triangles = []
+			triangleOffsets = []
+			for k, ( driverId, driverMesh ) in enumerate( drivers ):
+				triangleOffsets.append( len(triangles) // 3 )
+				triangles.extend( [ v + pointOffsets[k] for v in meshTriangles( driverMesh ) ] )
+			entry = entries[0] if len(entries) == 1 else None
+			return lambda job: splitDrivers( searchSurfaceBind( job, allPts, driverPts, triangles, entry ), driverIds, triangleOffsets )
+
+		if( bindMode == 3 ):
+			return lambda job: splitDrivers( searchDynamicBind( job, allPts, driverPts ), driverIds, pointOffsets[:-1] )
+
+		radius = self.bindRadius( data )
+		tolerance = data.inputValue( self.identity_tolerance ).asFloat()
+		processes = data.inputValue( self.bind_processes ).asInt()
+		snapshot = self.bindSnapshots.get( mIndex )
+		return lambda job: splitDrivers( searchBind( job, allPts, driverPts, radius, tolerance, processes, snapshot, repair ),
+										driverIds, pointOffsets[:-1] )
+
+
+	def applyBind( self, mIndex, result ):
+		vertMap, surface, snapshot, driverMap = result
+		if( snapshot is None ):
+			self.bindSnapshots.pop( mIndex, None )
+		else:
+			self.bindSnapshots[mIndex] = snapshot
+		self.writeVertMap( vertMap, surface, driverMap )
+
+
+	#==================================================
+	# bind
+	# runs outside of compute, from vertSnapBind, the idle queue or a save:
+	# reads the driven geometry and the drivers through the node's data block,
+	# searches, and stores the map on the plugs deform reads.  repair only
+	# repairs the last bind after an edit, and leaves the map alone when it
+	# can't be repaired.
+	def bind( self, background=None, repair=False ):
+		if( not repair ):
+			self.needsBind = False
+		data = self.forceCache()
+		if( background is None ):
+			background = data.inputValue( self.background_bind ).asBool()
+		#(in batch mode executeDeferred runs right away, so the background bind needs the UI)
+		background = background and OpenMaya.MGlobal.mayaState() == OpenMaya.MGlobal.kInteractive and not repair
+
+		mIndex = 0	# one map per node, made for geometry 0
+		self.bindSignature = self.inputSignature( data, mIndex )
+		iter, localToWorldMatrix = self.bindInputs( data, mIndex )
+		if( background ):
+			self.startBind( data, iter, localToWorldMatrix, mIndex )
+		else:
+			self.timedBind( data, iter, localToWorldMatrix, mIndex, repair )
+			self.storeBind()
+
+
+	def requestBind( self ):
+		#deform's way of asking for a bind: it runs from the idle queue, after the
+		#evaluation.  Batch sessions have no idle queue, there vertSnapBind or the
+		#next save binds:
+		self.needsBind = True
+		if( self.bindScheduled or self.bindJob is not None or OpenMaya.MGlobal.mayaState() != OpenMaya.MGlobal.kInteractive ):
+			return
+		self.bindScheduled = True
+		maya.utils.executeDeferred( self.deferredBind )
+
+
+	def deferredBind( self ):
+		self.bindScheduled = False
+		if( not self.needsBind or self.bindJob is not None ):
+			return
+		try:
+			self.bind()
+		except RuntimeError as e:
+			sys.stderr.write( "%s: bind failed (%s)\n" % (kPluginNodeTypeName, e) )
+			self.leaveReset()
+
+
+	#==================================================
+	# edit check
+	# A dirtied driven or driver mesh queues checkEdits() for the idle queue,
+	# which compares the inputs against what the last bind saw: a driven mesh
+	# edited in place is repaired from its BindSnapshot, a driver whose vertex
+	# count changed is bound again.  An animated input changes every frame, so
+	# nothing is checked during playback, and a change the repair can't absorb
+	# keeps the stored map (Re-Set Bind rebinds it).
+	def requestEditCheck( self ):
+		if( self.editCheckScheduled or self.bindSignature is None or
+			OpenMaya.MGlobal.mayaState() != OpenMaya.MGlobal.kInteractive or OpenMaya.MAnimControl.isPlaying() ):
+			return
+		self.editCheckScheduled = True
+		maya.utils.executeDeferred( self.checkEdits )
+
+
+	def checkEdits( self ):
+		self.editCheckScheduled = False
+		if( self.needsBind or self.bindJob is not None ):
+			return
+		try:
+			data = self.forceCache()
+			if( data.inputValue( self.initialized_data ).asShort() != 2 ):
+				return
+			signature = self.inputSignature( data, 0 )
+			if( signature == self.bindSignature ):
+				return
+			if( signature[1] != self.bindSignature[1] ):
+				self.requestBind()
+			else:
+				self.bind( False, repair=True )
+		except RuntimeError as e:
+			sys.stderr.write( "%s: bind repair failed (%s)\n" % (kPluginNodeTypeName, e) )
+
+
+	def inputSignature( self, data, mIndex ):
+		#( meshSignature of a driven mesh, vertex count per driver ), what checkEdits() compares:
+		inputs = data.inputArrayValue( OpenMayaMPx.cvar.MPxDeformerNode_input )
+		inputs.jumpToElement( mIndex )
+		driven = meshSignature( inputs.inputValue().child( OpenMayaMPx.cvar.MPxDeformerNode_inputGeom ).data() )
+		drivers = tuple( OpenMaya.MFnMesh( driverMesh ).numVertices() for driverId, driverMesh in self.driverMeshes( data ) )
+		return ( driven, drivers )
+
+
+	def bindInputs( self, data, mIndex ):
+		#( geometry iterator, local to world matrix ) of a driven geometry, as deform() gets them:
+		inputs = data.inputArrayValue( OpenMayaMPx.cvar.MPxDeformerNode_input )
+		inputs.jumpToElement( mIndex )
+		element = inputs.inputValue()
+		groupId = element.child( OpenMayaMPx.cvar.MPxDeformerNode_groupId ).asLong()
+		iter = OpenMaya.MItGeometry( element.child( OpenMayaMPx.cvar.MPxDeformerNode_inputGeom ), groupId, True )
+
+		#the world matrix of the shape the deformed geometry goes to:
+		localToWorldMatrix = OpenMaya.MMatrix()
+		shapes = OpenMaya.MPlugArray()
+		outputPlug = OpenMaya.MPlug( self.thisMObject(), OpenMayaMPx.cvar.MPxDeformerNode_outputGeom ).elementByLogicalIndex( mIndex )
+		outputPlug.connectedTo( shapes, False, True )
+		for k in range( 0, shapes.length() ):
+			if( shapes[k].node().hasFn( OpenMaya.MFn.kDagNode ) ):
+				path = OpenMaya.MDagPath()
+				OpenMaya.MDagPath.getAPathTo( shapes[k].node(), path )
+				localToWorldMatrix = path.inclusiveMatrix()
+				break
+		return ( iter, localToWorldMatrix )
+
+
+	#==================================================
+	# background bind
+	# startBind() gathers the points outside of compute and hands the search to
+	# a BindJob.  finishBind() runs from the idle queue once it is done and
+	# stores the new map, and the Bound it sets re-evaluates the node.
+	def startBind( self, data, iter, localToWorldMatrix, mIndex ):
+		if( self.bindJob is not None ):
+			return	# one search at a time, evaluations until it is done keep the stored map
+		self.bindJob = BindJob( self, mIndex, self.prepareBind( data, iter, localToWorldMatrix, mIndex ) )
+		self.bindJob.start()
+
+
+	def finishBind( self, job ):
+		if( job is not self.bindJob ):
+			return	# cancelled
+		self.bindJob = None
+		if( job.result is None ):
+			sys.stderr.write( "%s: background bind failed (%s)\n" % (kPluginNodeTypeName, job.error) )
+			self.leaveReset()
+			return
+		self.applyBind( job.mIndex, job.result )
+		self.stats.bindSeconds = job.seconds
+		self.storeBind()
+
+
+	def bindProgress( self ):
+		#0 to 1 for the running background bind, -1 when there is none:
+		return self.bindJob.progress if self.bindJob is not None else -1.0
+
+
+	def cancelBind( self ):
+		job = self.bindJob
+		if( job is None ):
+			return False
+		job.cancel()
+		self.bindJob = None
+		self.leaveReset()
+		return True
+
+
+	def leaveReset( self ):
+		#takes the node off Re-Set Bind without a new map, back to Bound if it has one:
+		try:
+			node = self.thisMObject()
+			tokens = intArrayFromData( OpenMaya.MPlug( node, self.vert_map_packed ).asMObject() )
+			bound = ( tokens and tokens[0] ) or OpenMaya.MPlug( node, self.vert_map ).numElements()
+			OpenMaya.MPlug( node, self.initialized_data ).setShort( 2 if bound else 0 )
+		except RuntimeError:
+			pass	# the node went away
+
+
+	def bindRadius( self, data ):
+		#grid radius mode only captures driven points within maxSnapDistance,
+		#closest point mode (or a zero radius) maps every driver vert:
+		if( data.inputValue( self.bind_mode ).asShort() == 1 ):
+			return max( data.inputValue( self.max_snap_distance ).asFloat(), 0.0 )
+		return 0.0
 	
 	
 	#this is really a brute force linear closest pt function,
-	#definately nothing fancy here (returns the pt index, not the point):
+	#definately nothing fancy here (returns the pt index, not the point).
+	#the bind uses KDTree.nearest() now, this is kept as the reference it must match:
 	def getClosestPt( self, pt, points ):
 		ptIndex=0
 		currentDistance = 9e99
@@ -183,6 +2470,309 @@ class vertSnapDeformer( OpenMayaMPx.MPxDeformerNode ):
 	
 	
 	
+#==================================================
+# Commands
+#
+# Every command takes one vertSnapDeformer node, selected or named.
+def commandNode( command, args, cmdName ):
+	'''
+	( MArgDatabase, node MObject, MFnDependencyNode, vertSnapDeformer ) of the
+	node a command was given, raising when it is not a vertSnapDeformer.
+	'''
+	argData = OpenMaya.MArgDatabase( command.syntax(), args )
+	selection = OpenMaya.MSelectionList()
+	argData.getObjects( selection )
+	node = OpenMaya.MObject()
+	selection.getDependNode( 0, node )
+	nodeFn = OpenMaya.MFnDependencyNode( node )
+	deformer = findNode( node ) if nodeFn.typeId() == vertSnapDeformerID else None
+	if( deformer is None ):
+		raise RuntimeError( "%s: select a %s node" % (cmdName, kPluginNodeTypeName) )
+	return ( argData, node, nodeFn, deformer )
+
+
+#==================================================
+# vertSnapBindMap command
+#
+#	vertSnapBindMap -export "/path/body.vsnp" vertSnapDeformer1;
+#	vertSnapBindMap -import "/path/body.vsnp" vertSnapDeformer1;
+#
+# -export writes the bound map of the deformer to disk, -import loads it back
+# and sets the deformer to Bound without running the closest point search.
+kExportFlag = "-ex"
+kExportLongFlag = "-export"
+kImportFlag = "-im"
+kImportLongFlag = "-import"
+
+class vertSnapBindMapCmd( OpenMayaMPx.MPxCommand ):
+	def __init__(self):
+		OpenMayaMPx.MPxCommand.__init__(self)
+
+
+	def doIt( self, args ):
+		argData, node, nodeFn, deformer = commandNode( self, args, kBindMapCmdName )
+
+		driverPrint = meshFingerprint( OpenMaya.MPlug( node, vertSnapDeformer.driver_mesh ).asMObject() )
+		drivenPrint = meshFingerprint( inputGeometryObject( node ) )
+		initPlug = OpenMaya.MPlug( node, vertSnapDeformer.initialized_data )
+		packedPlug = OpenMaya.MPlug( node, vertSnapDeformer.vert_map_packed )
+
+		if( argData.isFlagSet( kExportFlag ) ):
+			if( initPlug.asShort() != 2 ):
+				raise RuntimeError( "%s: %s is not bound" % (kBindMapCmdName, nodeFn.name()) )
+			for plug in ( vertSnapDeformer.surface_triangles, vertSnapDeformer.driver_map_packed ):
+				tokens = intArrayFromData( OpenMaya.MPlug( node, plug ).asMObject() )
+				if( tokens and tokens[0] ):
+					raise RuntimeError( "%s: bind map files only hold closest point binds to vertSnapInput" % kBindMapCmdName )
+			vertMap = storedVertMap( node )
+			if( not len(vertMap) ):
+				raise RuntimeError( "%s: %s has no stored map to export" % (kBindMapCmdName, nodeFn.name()) )
+			writeBindMapFile( argData.flagArgumentString( kExportFlag, 0 ), vertMap, driverPrint, drivenPrint )
+
+		elif( argData.isFlagSet( kImportFlag ) ):
+			tokens = readBindMapFile( argData.flagArgumentString( kImportFlag, 0 ), driverPrint, drivenPrint )
+			#a running or not yet stored bind would overwrite the imported map later,
+			#and a repair must not start from the snapshot of the map it replaces:
+			deformer.cancelBind()
+			deformer.pendingTokens = None
+			deformer.pendingSurface = None
+			deformer.pendingDrivers = None
+			deformer.bindSnapshots.pop( 0, None )
+			packedPlug.setMObject( intArrayData( tokens ) )
+			OpenMaya.MPlug( node, vertSnapDeformer.surface_triangles ).setMObject( intArrayData( [] ) )
+			OpenMaya.MPlug( node, vertSnapDeformer.driver_map_packed ).setMObject( intArrayData( [] ) )
+			initPlug.setShort( 2 )
+
+		else:
+			raise RuntimeError( "%s: use -export or -import" % kBindMapCmdName )
+
+
+def inputGeometryObject( node, mIndex=0 ):
+	'''the un-deformed input mesh of a deformer node'''
+	inputPlug = OpenMaya.MPlug( node, OpenMayaMPx.cvar.MPxDeformerNode_input ).elementByLogicalIndex( mIndex )
+	return inputPlug.child( OpenMayaMPx.cvar.MPxDeformerNode_inputGeom ).asMObject()
+
+
+def storedVertMap( node ):
+	'''
+	the vertex map stored on a vertSnapDeformer node: vtxIndexMapPacked, or
+	the per-element vtxIndexMap multi of a node bound before the packed map
+	'''
+	tokens = intArrayFromData( OpenMaya.MPlug( node, vertSnapDeformer.vert_map_packed ).asMObject() )
+	if( tokens ):
+		return unpackVertMap( tokens )
+
+	legacyPlug = OpenMaya.MPlug( node, vertSnapDeformer.vert_map )
+	indices = OpenMaya.MIntArray()
+	legacyPlug.getExistingArrayAttributeIndices( indices )
+	vertMap = []
+	for k in range( 0, indices.length() ):
+		index = indices[k]
+		if( index >= len(vertMap) ):
+			vertMap.extend( [-1] * (index + 1 - len(vertMap)) )
+		vertMap[index] = legacyPlug.elementByLogicalIndex( index ).asInt()
+	return vertMap
+
+
+def bindMapCmdCreator():
+	return OpenMayaMPx.asMPxPtr( vertSnapBindMapCmd() )
+
+
+def bindMapSyntaxCreator():
+	syntax = OpenMaya.MSyntax()
+	syntax.addFlag( kExportFlag, kExportLongFlag, OpenMaya.MSyntax.kString )
+	syntax.addFlag( kImportFlag, kImportLongFlag, OpenMaya.MSyntax.kString )
+	syntax.useSelectionAsDefault( True )
+	syntax.setObjectType( OpenMaya.MSyntax.kSelectionList, 1, 1 )
+	return syntax
+
+
+#==================================================
+# vertSnapStats command
+#
+#	vertSnapStats vertSnapDeformer1;
+#	vertSnapStats -reset vertSnapDeformer1;
+#
+# returns [last bind seconds, last deform seconds, mapped verts, active verts,
+# evaluations] for the node, -reset zeroes them.
+kResetFlag = "-r"
+kResetLongFlag = "-reset"
+
+class vertSnapStatsCmd( OpenMayaMPx.MPxCommand ):
+	def __init__(self):
+		OpenMayaMPx.MPxCommand.__init__(self)
+
+
+	def doIt( self, args ):
+		argData, node, nodeFn, deformer = commandNode( self, args, kStatsCmdName )
+
+		if( argData.isFlagSet( kResetFlag ) ):
+			deformer.stats.reset()
+			return
+
+		result = OpenMaya.MDoubleArray()
+		for value in deformer.stats.values():
+			result.append( value )
+		self.setResult( result )
+
+
+def statsCmdCreator():
+	return OpenMayaMPx.asMPxPtr( vertSnapStatsCmd() )
+
+
+def statsSyntaxCreator():
+	syntax = OpenMaya.MSyntax()
+	syntax.addFlag( kResetFlag, kResetLongFlag )
+	syntax.useSelectionAsDefault( True )
+	syntax.setObjectType( OpenMaya.MSyntax.kSelectionList, 1, 1 )
+	return syntax
+
+
+#==================================================
+# vertSnapBake command
+#
+#	vertSnapBake -file "/path/shot.vsnb" -startFrame 1 -endFrame 120 vertSnapDeformer1;
+#
+# steps the scene through the frame range, stores the deformed positions of
+# the active vertices as deltas from the input in a bake cache file, then
+# points the node's cacheFile at it and hooks its time input up to time1.
+# Turn on the node's playback attribute to play the cache back.
+kFileFlag = "-f"
+kFileLongFlag = "-file"
+kStartFlag = "-sf"
+kStartLongFlag = "-startFrame"
+kEndFlag = "-ef"
+kEndLongFlag = "-endFrame"
+kStepFlag = "-st"
+kStepLongFlag = "-step"
+
+class vertSnapBakeCmd( OpenMayaMPx.MPxCommand ):
+	def __init__(self):
+		OpenMayaMPx.MPxCommand.__init__(self)
+
+
+	def doIt( self, args ):
+		argData, node, nodeFn, deformer = commandNode( self, args, kBakeCmdName )
+		if( numpy is None ):
+			raise RuntimeError( "%s: baking needs numpy" % kBakeCmdName )
+		if( not argData.isFlagSet( kFileFlag ) or not argData.isFlagSet( kStartFlag ) or not argData.isFlagSet( kEndFlag ) ):
+			raise RuntimeError( "%s: -file, -startFrame and -endFrame are required" % kBakeCmdName )
+
+		path = argData.flagArgumentString( kFileFlag, 0 )
+		start = argData.flagArgumentDouble( kStartFlag, 0 )
+		end = argData.flagArgumentDouble( kEndFlag, 0 )
+		step = argData.flagArgumentDouble( kStepFlag, 0 ) if argData.isFlagSet( kStepFlag ) else 1.0
+		if( step <= 0 or end < start ):
+			raise RuntimeError( "%s: empty frame range" % kBakeCmdName )
+		frames = []
+		while( start + len(frames) * step <= end + 1e-6 ):
+			frames.append( start + len(frames) * step )
+
+		OpenMaya.MPlug( node, vertSnapDeformer.playback ).setBool( False )
+		data = deformer.forceCache()
+		if( data.inputValue( vertSnapDeformer.initialized_data ).asShort() != 2 ):
+			raise RuntimeError( "%s: %s is not bound" % (kBakeCmdName, nodeFn.name()) )
+		#every mapped vertex is baked, whichever frames its weight or the envelope let it move on:
+		surface = deformer.readSurfaceMap( data )
+		mapped = numpy.flatnonzero( numpy.asarray( surface[0] if surface is not None else deformer.readVertMap( data ) ) >= 0 )
+
+		outputPlug = OpenMaya.MPlug( node, OpenMayaMPx.cvar.MPxDeformerNode_outputGeom ).elementByLogicalIndex( 0 )
+		unit = OpenMaya.MTime.uiUnit()
+		current = OpenMaya.MAnimControl.currentTime()
+		# playback may still have this file mapped, which breaks writing over it
+		deformer.closeBakeCache()
+		f = open( path, 'wb' )
+		try:
+			indices = None
+			for frame in frames:
+				OpenMaya.MAnimControl.setCurrentTime( OpenMaya.MTime( frame, unit ) )
+				output = OpenMaya.MPointArray()
+				OpenMaya.MFnMesh( outputPlug.asMObject() ).getPoints( output )
+				input = OpenMaya.MPointArray()
+				OpenMaya.MFnMesh( inputGeometryObject( node ) ).getPoints( input )
+				if( indices is None ):
+					indices = mapped[mapped < output.length()].tolist()
+					writeBakeHeader( f, output.length(), indices, frames )
+				writeBakeFrame( f, (pointsToArray( output ) - pointsToArray( input ))[indices, :3] )
+		finally:
+			f.close()
+			OpenMaya.MAnimControl.setCurrentTime( current )
+
+		OpenMaya.MPlug( node, vertSnapDeformer.cache_file ).setString( path )
+		timePlug = OpenMaya.MPlug( node, vertSnapDeformer.time_data )
+		if( not timePlug.isConnected() ):
+			maya.cmds.connectAttr( 'time1.outTime', '%s.time' % nodeFn.name() )
+
+
+def bakeCmdCreator():
+	return OpenMayaMPx.asMPxPtr( vertSnapBakeCmd() )
+
+
+def bakeSyntaxCreator():
+	syntax = OpenMaya.MSyntax()
+	syntax.addFlag( kFileFlag, kFileLongFlag, OpenMaya.MSyntax.kString )
+	syntax.addFlag( kStartFlag, kStartLongFlag, OpenMaya.MSyntax.kDouble )
+	syntax.addFlag( kEndFlag, kEndLongFlag, OpenMaya.MSyntax.kDouble )
+	syntax.addFlag( kStepFlag, kStepLongFlag, OpenMaya.MSyntax.kDouble )
+	syntax.useSelectionAsDefault( True )
+	syntax.setObjectType( OpenMaya.MSyntax.kSelectionList, 1, 1 )
+	return syntax
+
+
+#==================================================
+# vertSnapBind command
+#
+#	vertSnapBind vertSnapDeformer1;
+#	vertSnapBind -background vertSnapDeformer1;
+#	vertSnapBind -progress vertSnapDeformer1;
+#	vertSnapBind -cancel vertSnapDeformer1;
+#
+# binds the deformer and stores the map on it right away, without waiting for
+# an idle event (the way to bind from batch scripts).  -background starts the
+# search on a worker thread instead and returns, -progress gives how far it is
+# (0 to 1, -1 when none is running) and -cancel drops it, keeping the old map.
+kBackgroundFlag = "-bg"
+kBackgroundLongFlag = "-background"
+kProgressFlag = "-pr"
+kProgressLongFlag = "-progress"
+kCancelFlag = "-c"
+kCancelLongFlag = "-cancel"
+
+class vertSnapBindCmd( OpenMayaMPx.MPxCommand ):
+	def __init__(self):
+		OpenMayaMPx.MPxCommand.__init__(self)
+
+
+	def doIt( self, args ):
+		argData, node, nodeFn, deformer = commandNode( self, args, kBindCmdName )
+
+		if( argData.isFlagSet( kProgressFlag ) ):
+			self.setResult( deformer.bindProgress() )
+			return
+		if( argData.isFlagSet( kCancelFlag ) ):
+			self.setResult( deformer.cancelBind() )
+			return
+
+		deformer.cancelBind()
+		deformer.pendingTokens = None
+		#searches (or starts the search) here, outside of compute, and stores the map:
+		deformer.bind( argData.isFlagSet( kBackgroundFlag ) )
+
+
+def bindCmdCreator():
+	return OpenMayaMPx.asMPxPtr( vertSnapBindCmd() )
+
+
+def bindSyntaxCreator():
+	syntax = OpenMaya.MSyntax()
+	syntax.addFlag( kBackgroundFlag, kBackgroundLongFlag )
+	syntax.addFlag( kProgressFlag, kProgressLongFlag )
+	syntax.addFlag( kCancelFlag, kCancelLongFlag )
+	syntax.useSelectionAsDefault( True )
+	syntax.setObjectType( OpenMaya.MSyntax.kSelectionList, 1, 1 )
+	return syntax
+
+
 #==================================================	
 # creator
 def nodeCreator():
@@ -194,6 +2784,7 @@ def nodeInitializer():
 	numericAttr = OpenMaya.MFnNumericAttribute()
 	polyMeshAttr = OpenMaya.MFnTypedAttribute()
 	enumAttr = OpenMaya.MFnEnumAttribute()
+	unitAttr = OpenMaya.MFnUnitAttribute()
 	
 	
 	vertSnapDeformer.driver_mesh = polyMeshAttr.create( "vertSnapInput", "vsnpin", OpenMaya.MFnData.kMesh )
@@ -202,6 +2793,14 @@ def nodeInitializer():
 	vertSnapDeformer.addAttribute( vertSnapDeformer.driver_mesh )
 	vertSnapDeformer.attributeAffects( vertSnapDeformer.driver_mesh, OpenMayaMPx.cvar.MPxDeformerNode_outputGeom )
 
+	vertSnapDeformer.driver_meshes = polyMeshAttr.create( "vertSnapInputs", "vsnpins", OpenMaya.MFnData.kMesh )
+	polyMeshAttr.setArray(True)
+	polyMeshAttr.setIndexMatters(False)
+	polyMeshAttr.setStorable(False)
+	polyMeshAttr.setConnectable(True)
+	vertSnapDeformer.addAttribute( vertSnapDeformer.driver_meshes )
+	vertSnapDeformer.attributeAffects( vertSnapDeformer.driver_meshes, OpenMayaMPx.cvar.MPxDeformerNode_outputGeom )
+
 	vertSnapDeformer.initialized_data = enumAttr.create( "initialize", "inl" )
 	enumAttr.addField(	"Off", 0)
 	enumAttr.addField(	"Re-Set Bind", 1)	
@@ -223,6 +2822,101 @@ def nodeInitializer():
 	vertSnapDeformer.addAttribute( vertSnapDeformer.vert_map )
 	vertSnapDeformer.attributeAffects( vertSnapDeformer.vert_map, OpenMayaMPx.cvar.MPxDeformerNode_outputGeom  )
 
+	vertSnapDeformer.vert_map_packed = polyMeshAttr.create( "vtxIndexMapPacked", "vtxpk", OpenMaya.MFnData.kIntArray )
+	polyMeshAttr.setKeyable(False)
+	polyMeshAttr.setStorable(True)
+	polyMeshAttr.setReadable(True)
+	polyMeshAttr.setWritable(True)
+	polyMeshAttr.setHidden(True)
+	vertSnapDeformer.addAttribute( vertSnapDeformer.vert_map_packed )
+	vertSnapDeformer.attributeAffects( vertSnapDeformer.vert_map_packed, OpenMayaMPx.cvar.MPxDeformerNode_outputGeom )
+
+	vertSnapDeformer.driver_map_packed = polyMeshAttr.create( "vtxDriverMapPacked", "vtxdpk", OpenMaya.MFnData.kIntArray )
+	polyMeshAttr.setStorable(True)
+	polyMeshAttr.setHidden(True)
+	vertSnapDeformer.addAttribute( vertSnapDeformer.driver_map_packed )
+	vertSnapDeformer.attributeAffects( vertSnapDeformer.driver_map_packed, OpenMayaMPx.cvar.MPxDeformerNode_outputGeom )
+
+	vertSnapDeformer.surface_triangles = polyMeshAttr.create( "surfaceTriangles", "sftri", OpenMaya.MFnData.kIntArray )
+	polyMeshAttr.setStorable(True)
+	polyMeshAttr.setHidden(True)
+	vertSnapDeformer.addAttribute( vertSnapDeformer.surface_triangles )
+	vertSnapDeformer.attributeAffects( vertSnapDeformer.surface_triangles, OpenMayaMPx.cvar.MPxDeformerNode_outputGeom )
+
+	vertSnapDeformer.surface_weights = polyMeshAttr.create( "surfaceWeights", "sfwt", OpenMaya.MFnData.kDoubleArray )
+	polyMeshAttr.setStorable(True)
+	polyMeshAttr.setHidden(True)
+	vertSnapDeformer.addAttribute( vertSnapDeformer.surface_weights )
+	vertSnapDeformer.attributeAffects( vertSnapDeformer.surface_weights, OpenMayaMPx.cvar.MPxDeformerNode_outputGeom )
+
+	vertSnapDeformer.num_threads = numericAttr.create( "numThreads", "nth", OpenMaya.MFnNumericData.kInt, 1 )
+	numericAttr.setMin(0)
+	numericAttr.setKeyable(False)
+	numericAttr.setStorable(True)
+	numericAttr.setChannelBox(True)
+	vertSnapDeformer.addAttribute( vertSnapDeformer.num_threads )
+	vertSnapDeformer.attributeAffects( vertSnapDeformer.num_threads, OpenMayaMPx.cvar.MPxDeformerNode_outputGeom )
+
+	vertSnapDeformer.bind_mode = enumAttr.create( "bindMode", "bmd" )
+	enumAttr.addField(	"Closest Point", 0)
+	enumAttr.addField(	"Grid Radius", 1)
+	enumAttr.addField(	"Closest Surface", 2)
+	enumAttr.addField(	"Dynamic", 3)
+	enumAttr.setKeyable(False)
+	enumAttr.setStorable(True)
+	enumAttr.setChannelBox(True)
+	enumAttr.setDefault(0)
+	vertSnapDeformer.addAttribute( vertSnapDeformer.bind_mode )
+	vertSnapDeformer.attributeAffects( vertSnapDeformer.bind_mode, OpenMayaMPx.cvar.MPxDeformerNode_outputGeom )	# Dynamic re-resolves in deform
+
+	vertSnapDeformer.max_snap_distance = numericAttr.create( "maxSnapDistance", "msd", OpenMaya.MFnNumericData.kFloat, 1.0 )
+	numericAttr.setMin(0.0)
+	numericAttr.setKeyable(False)
+	numericAttr.setStorable(True)
+	numericAttr.setChannelBox(True)
+	vertSnapDeformer.addAttribute( vertSnapDeformer.max_snap_distance )
+
+	vertSnapDeformer.bind_processes = numericAttr.create( "bindProcesses", "bpr", OpenMaya.MFnNumericData.kInt, 0 )
+	numericAttr.setMin(0)
+	numericAttr.setKeyable(False)
+	numericAttr.setStorable(True)
+	vertSnapDeformer.addAttribute( vertSnapDeformer.bind_processes )
+
+	vertSnapDeformer.identity_tolerance = numericAttr.create( "identityTolerance", "itl", OpenMaya.MFnNumericData.kFloat, 0.001 )
+	numericAttr.setMin(0.0)
+	numericAttr.setKeyable(False)
+	numericAttr.setStorable(True)
+	vertSnapDeformer.addAttribute( vertSnapDeformer.identity_tolerance )
+
+	vertSnapDeformer.background_bind = numericAttr.create( "backgroundBind", "bgb", OpenMaya.MFnNumericData.kBoolean, False )
+	numericAttr.setKeyable(False)
+	numericAttr.setStorable(True)
+	vertSnapDeformer.addAttribute( vertSnapDeformer.background_bind )
+
+	vertSnapDeformer.bind_memory_budget = numericAttr.create( "bindMemoryBudget", "bmb", OpenMaya.MFnNumericData.kInt, 0 )
+	numericAttr.setMin(0)
+	numericAttr.setKeyable(False)
+	numericAttr.setStorable(True)
+	vertSnapDeformer.addAttribute( vertSnapDeformer.bind_memory_budget )
+
+	vertSnapDeformer.playback = numericAttr.create( "playback", "pbk", OpenMaya.MFnNumericData.kBoolean, False )
+	numericAttr.setKeyable(False)
+	numericAttr.setStorable(True)
+	numericAttr.setChannelBox(True)
+	vertSnapDeformer.addAttribute( vertSnapDeformer.playback )
+	vertSnapDeformer.attributeAffects( vertSnapDeformer.playback, OpenMayaMPx.cvar.MPxDeformerNode_outputGeom )
+
+	vertSnapDeformer.cache_file = polyMeshAttr.create( "cacheFile", "cfl", OpenMaya.MFnData.kString )
+	polyMeshAttr.setStorable(True)
+	polyMeshAttr.setUsedAsFilename(True)
+	vertSnapDeformer.addAttribute( vertSnapDeformer.cache_file )
+	vertSnapDeformer.attributeAffects( vertSnapDeformer.cache_file, OpenMayaMPx.cvar.MPxDeformerNode_outputGeom )
+
+	vertSnapDeformer.time_data = unitAttr.create( "time", "tm", OpenMaya.MFnUnitAttribute.kTime, 0.0 )
+	unitAttr.setStorable(False)
+	vertSnapDeformer.addAttribute( vertSnapDeformer.time_data )
+	vertSnapDeformer.attributeAffects( vertSnapDeformer.time_data, OpenMayaMPx.cvar.MPxDeformerNode_outputGeom )
+
 	# make weights paintable
 	maya.cmds.makePaintable( kPluginNodeTypeName, 'weights', attrType='multiFloat' )
 	
@@ -235,13 +2929,52 @@ def initializePlugin(mobject):
 		mplugin.registerNode( kPluginNodeTypeName, vertSnapDeformerID, nodeCreator, nodeInitializer, OpenMayaMPx.MPxNode.kDeformerNode )
 	except:
 		sys.stderr.write( "Failed to register node: %s\n" % kPluginNodeTypeName )
+	try:
+		mplugin.registerCommand( kBindMapCmdName, bindMapCmdCreator, bindMapSyntaxCreator )
+	except:
+		sys.stderr.write( "Failed to register command: %s\n" % kBindMapCmdName )
+	try:
+		mplugin.registerCommand( kStatsCmdName, statsCmdCreator, statsSyntaxCreator )
+	except:
+		sys.stderr.write( "Failed to register command: %s\n" % kStatsCmdName )
+	try:
+		mplugin.registerCommand( kBakeCmdName, bakeCmdCreator, bakeSyntaxCreator )
+	except:
+		sys.stderr.write( "Failed to register command: %s\n" % kBakeCmdName )
+	try:
+		mplugin.registerCommand( kBindCmdName, bindCmdCreator, bindSyntaxCreator )
+	except:
+		sys.stderr.write( "Failed to register command: %s\n" % kBindCmdName )
+	for message in ( OpenMaya.MSceneMessage.kBeforeSave, OpenMaya.MSceneMessage.kBeforeExport ):
+		_sceneCallbacks.append( OpenMaya.MSceneMessage.addCallback( message, storePendingBinds ) )
 
 # uninitialize the script plug-in
 def uninitializePlugin(mobject):
 	mplugin = OpenMayaMPx.MFnPlugin(mobject)
+	closeThreadPools()
+	clearDriverCache()
+	for callback in _sceneCallbacks:
+		OpenMaya.MMessage.removeCallback( callback )
+	del _sceneCallbacks[:]
 	try:
 		mplugin.deregisterNode( vertSnapDeformerID )
 	except:
 		sys.stderr.write( "Failed to unregister node: %s\n" % kPluginNodeTypeName )
+	try:
+		mplugin.deregisterCommand( kBindMapCmdName )
+	except:
+		sys.stderr.write( "Failed to unregister command: %s\n" % kBindMapCmdName )
+	try:
+		mplugin.deregisterCommand( kStatsCmdName )
+	except:
+		sys.stderr.write( "Failed to unregister command: %s\n" % kStatsCmdName )
+	try:
+		mplugin.deregisterCommand( kBakeCmdName )
+	except:
+		sys.stderr.write( "Failed to unregister command: %s\n" % kBakeCmdName )
+	try:
+		mplugin.deregisterCommand( kBindCmdName )
+	except:
+		sys.stderr.write( "Failed to unregister command: %s\n" % kBindCmdName )
 
 		
\ No newline at end of file
@@ -0,0 +1,494 @@
+##############################################################################
+'''
+vertSnapSearch.py
+
+Spatial search structures of the vertSnapDeformer python plugin, and the
+entry points of its bind worker processes.
+
+Kept free of maya imports, so the worker processes of a process pool bind
+(spawned mayapy interpreters) can import it by name: vertSnapDeformer.py
+puts this folder on sys.path while it imports it and while the pool starts.
+'''
+##############################################################################
+
+import array, bisect, math
+
+
+#==================================================
+# Spatial index
+class KDTree( object ):
+	'''
+	Static kd-tree over a flat [x0, y0, z0, x1, y1, z1, ...] coordinate buffer.
+
+	Built once per bind over the driven points and queried for every driver
+	vertex, so the bind is O(N log N) instead of O(driver * driven).
+	nearest() breaks distance ties on the lowest point index, which is what
+	the linear scan in vertSnapDeformer.getClosestPt() does, so both always
+	return the same index.  A bind repair queries it with skip, the indices
+	of points that changed since it was built, and their new coordinates
+	swapped in.
+
+	flatten() and restore() move a built tree between processes as its flat
+	arrays, so a worker queries the tree the bind built instead of building
+	its own.
+	'''
+	leafSize = 8
+	flatArrays = ( ('perm', 'i'), ('nodeLo', 'i'), ('nodeHi', 'i'), ('nodeLeft', 'i'), ('nodeRight', 'i'),
+				   ('nodeAxis', 'b'), ('nodeSplit', 'd') )
+
+	def __init__( self, coords, leafSize=None ):
+		if( leafSize is not None ):
+			self.leafSize = leafSize
+		self.coords = coords
+		self.count = len(coords) // 3
+		self.perm = array.array( 'i', range(self.count) )
+
+		# node arrays (a leaf has nodeLeft == -1 and owns perm[lo:hi])
+		self.nodeLo = array.array( 'i' )
+		self.nodeHi = array.array( 'i' )
+		self.nodeLeft = array.array( 'i' )
+		self.nodeRight = array.array( 'i' )
+		self.nodeAxis = array.array( 'b' )
+		self.nodeSplit = array.array( 'd' )
+
+		if( self.count ):
+			self.build()
+
+
+	def flatten( self ):
+		'''{ name: ( typecode, array ) } of everything but the coords'''
+		return dict( ( name, (typecode, getattr( self, name )) ) for name, typecode in self.flatArrays )
+
+
+	@classmethod
+	def restore( cls, coords, arrays ):
+		'''the tree flatten() was called on, over coords, with no build'''
+		tree = cls.__new__( cls )
+		tree.coords = coords
+		tree.count = len(coords) // 3
+		for name, typecode in cls.flatArrays:
+			setattr( tree, name, arrays[name] )
+		return tree
+
+
+	def addNode( self, lo, hi ):
+		self.nodeLo.append( lo )
+		self.nodeHi.append( hi )
+		self.nodeLeft.append( -1 )
+		self.nodeRight.append( -1 )
+		self.nodeAxis.append( 0 )
+		self.nodeSplit.append( 0.0 )
+		return len(self.nodeLo) - 1
+
+
+	def build( self ):
+		c = self.coords
+		perm = self.perm
+		stack = [ self.addNode( 0, self.count ) ]
+
+		while( stack ):
+			node = stack.pop()
+			lo = self.nodeLo[node]
+			hi = self.nodeHi[node]
+			if( hi - lo <= self.leafSize ):
+				continue
+
+			# split on the axis with the widest spread, at the median point
+			sub = perm[lo:hi]
+			axis = 0
+			widest = -1.0
+			for a in range( 0, 3 ):
+				vals = [ c[3*i + a] for i in sub ]
+				spread = max(vals) - min(vals)
+				if( spread > widest ):
+					axis = a
+					widest = spread
+
+			perm[lo:hi] = array.array( 'i', sorted( sub, key=lambda i: c[3*i + axis] ) )
+			mid = (lo + hi) // 2
+
+			self.nodeAxis[node] = axis
+			self.nodeSplit[node] = c[3*perm[mid] + axis]
+			self.nodeLeft[node] = self.addNode( lo, mid )
+			self.nodeRight[node] = self.addNode( mid, hi )
+			stack.append( self.nodeLeft[node] )
+			stack.append( self.nodeRight[node] )
+
+
+	def nearest( self, x, y, z, skip=None ):
+		# same defaults as getClosestPt(), including index 0 for an empty buffer,
+		# -1 when skip leaves no point:
+		bestIndex = 0 if skip is None else -1
+		bestDistance = 9e99
+		if( self.count == 0 ):
+			return bestIndex
+
+		c = self.coords
+		perm = self.perm
+		q = (x, y, z)
+		sqrt = math.sqrt
+		stack = [ (0, 0.0) ]
+
+		while( stack ):
+			node, planeDistance = stack.pop()
+			# ">" rather than ">=" so equally distant points with a lower index are still found
+			if( planeDistance > bestDistance ):
+				continue
+
+			left = self.nodeLeft[node]
+			if( left == -1 ):
+				leaf = perm[self.nodeLo[node]:self.nodeHi[node]]
+				if( skip ):
+					leaf = [ i for i in leaf if i not in skip ]
+				for i in leaf:
+					dx = c[3*i] - x
+					dy = c[3*i + 1] - y
+					dz = c[3*i + 2] - z
+					d = sqrt( dx*dx + dy*dy + dz*dz )
+					if( d < bestDistance or (d == bestDistance and i < bestIndex) ):
+						bestIndex = i
+						bestDistance = d
+				continue
+
+			diff = q[self.nodeAxis[node]] - self.nodeSplit[node]
+			if( diff < 0.0 ):
+				stack.append( (self.nodeRight[node], -diff) )
+				stack.append( (left, 0.0) )
+			else:
+				stack.append( (left, diff) )
+				stack.append( (self.nodeRight[node], 0.0) )
+
+		return bestIndex
+
+
+class SpatialHash( object ):
+	'''
+	Uniform grid over a flat [x0, y0, z0, ...] coordinate buffer, with cells
+	as wide as the search radius.
+
+	nearest() only visits the 27 cells around the query, and returns -1 when
+	no point lies within the radius, so a driver patch only captures the
+	driven vertices near it. Ties go to the lowest index, and skip leaves
+	points out, like KDTree.
+
+	flatten() and restore() move it between processes like KDTree's, the
+	cells becoming a sorted table of cell codes (PackedCells).
+	'''
+	def __init__( self, coords, radius ):
+		self.coords = coords
+		self.count = len(coords) // 3
+		self.radius = radius
+		self.cells = {}
+
+		inv = 1.0 / radius
+		floor = math.floor
+		cells = self.cells
+		for i in range( 0, self.count ):
+			key = ( int(floor(coords[3*i] * inv)), int(floor(coords[3*i + 1] * inv)), int(floor(coords[3*i + 2] * inv)) )
+			bucket = cells.get( key )
+			if( bucket is None ):
+				cells[key] = [ i ]
+			else:
+				bucket.append( i )
+
+
+	def flatten( self ):
+		'''
+		{ name: ( typecode, array ) } of the cells, or None when the grid spans
+		too many cells for an int64 code
+		'''
+		keys = sorted( self.cells )
+		lo = [ min( key[a] for key in keys ) if keys else 0 for a in range( 0, 3 ) ]
+		size = [ max( key[a] for key in keys ) - lo[a] + 1 if keys else 1 for a in range( 0, 3 ) ]
+		if( size[0] * size[1] * size[2] >= 2**63 ):
+			return None
+
+		codes = array.array( 'q' )
+		starts = array.array( 'i', [0] )
+		order = array.array( 'i' )
+		for key in keys:	# sorted keys are sorted codes
+			codes.append( ((key[0] - lo[0]) * size[1] + key[1] - lo[1]) * size[2] + key[2] - lo[2] )
+			order.extend( self.cells[key] )
+			starts.append( len(order) )
+		return { 'extent': ('q', array.array( 'q', lo + size )), 'codes': ('q', codes), 'starts': ('i', starts), 'order': ('i', order) }
+
+
+	@classmethod
+	def restore( cls, coords, radius, arrays ):
+		'''the grid flatten() was called on, over coords, with no build'''
+		grid = cls.__new__( cls )
+		grid.coords = coords
+		grid.count = len(coords) // 3
+		grid.radius = radius
+		grid.cells = PackedCells( arrays['extent'], arrays['codes'], arrays['starts'], arrays['order'] )
+		return grid
+
+
+	def nearest( self, x, y, z, skip=None ):
+		bestIndex = -1
+		bestDistance = self.radius
+		inv = 1.0 / self.radius
+		cx = int( math.floor(x * inv) )
+		cy = int( math.floor(y * inv) )
+		cz = int( math.floor(z * inv) )
+
+		c = self.coords
+		cells = self.cells
+		sqrt = math.sqrt
+		for i in range( cx-1, cx+2 ):
+			for j in range( cy-1, cy+2 ):
+				for k in range( cz-1, cz+2 ):
+					bucket = cells.get( (i, j, k), () )
+					if( skip ):
+						bucket = [ n for n in bucket if n not in skip ]
+					for n in bucket:
+						dx = c[3*n] - x
+						dy = c[3*n + 1] - y
+						dz = c[3*n + 2] - z
+						d = sqrt( dx*dx + dy*dy + dz*dz )
+						if( d < bestDistance or (d == bestDistance and (bestIndex == -1 or n < bestIndex)) ):
+							bestIndex = n
+							bestDistance = d
+		return bestIndex
+
+
+class PackedCells( object ):
+	'''
+	The cells dict of a SpatialHash as flat arrays: the ( x, y, z ) cell key
+	coded as one int from the grid extent (lo x, y, z then size x, y, z), the
+	sorted codes, and the point indices of cell k in order[starts[k]:starts[k + 1]].
+	get() looks a key up by bisection, like dict.get().
+	'''
+	def __init__( self, extent, codes, starts, order ):
+		self.lo = tuple( extent[0:3] )
+		self.size = tuple( extent[3:6] )
+		self.codes = codes
+		self.starts = starts
+		self.order = order
+
+
+	def get( self, key, default=None ):
+		x = key[0] - self.lo[0]
+		y = key[1] - self.lo[1]
+		z = key[2] - self.lo[2]
+		if( not (0 <= x < self.size[0] and 0 <= y < self.size[1] and 0 <= z < self.size[2]) ):
+			return default
+		code = (x * self.size[1] + y) * self.size[2] + z
+		k = bisect.bisect_left( self.codes, code )
+		if( k == len(self.codes) or self.codes[k] != code ):
+			return default
+		return self.order[self.starts[k]:self.starts[k + 1]]
+
+
+#==================================================
+# Closest surface point
+def closestOnTriangle( px, py, pz, ax, ay, az, bx, by, bz, cx, cy, cz ):
+	'''
+	Barycentric ( u, v ) of the point of triangle abc closest to p, the point
+	being a + u * (b - a) + v * (c - a).  Walks the Voronoi regions of the
+	corners and edges before falling back to the face.
+	'''
+	abx = bx - ax; aby = by - ay; abz = bz - az
+	acx = cx - ax; acy = cy - ay; acz = cz - az
+	apx = px - ax; apy = py - ay; apz = pz - az
+	d1 = abx*apx + aby*apy + abz*apz
+	d2 = acx*apx + acy*apy + acz*apz
+	if( d1 <= 0.0 and d2 <= 0.0 ):
+		return ( 0.0, 0.0 )
+
+	bpx = px - bx; bpy = py - by; bpz = pz - bz
+	d3 = abx*bpx + aby*bpy + abz*bpz
+	d4 = acx*bpx + acy*bpy + acz*bpz
+	if( d3 >= 0.0 and d4 <= d3 ):
+		return ( 1.0, 0.0 )
+
+	vc = d1*d4 - d3*d2
+	if( vc <= 0.0 and d1 >= 0.0 and d3 <= 0.0 ):
+		return ( d1 / (d1 - d3) if d1 != d3 else 0.0, 0.0 )
+
+	cpx = px - cx; cpy = py - cy; cpz = pz - cz
+	d5 = abx*cpx + aby*cpy + abz*cpz
+	d6 = acx*cpx + acy*cpy + acz*cpz
+	if( d6 >= 0.0 and d5 <= d6 ):
+		return ( 0.0, 1.0 )
+
+	vb = d5*d2 - d1*d6
+	if( vb <= 0.0 and d2 >= 0.0 and d6 <= 0.0 ):
+		return ( 0.0, d2 / (d2 - d6) if d2 != d6 else 0.0 )
+
+	va = d3*d6 - d5*d4
+	if( va <= 0.0 and (d4 - d3) >= 0.0 and (d5 - d6) >= 0.0 ):
+		w = (d4 - d3) / ((d4 - d3) + (d5 - d6)) if (d4 - d3) + (d5 - d6) != 0.0 else 0.0
+		return ( 1.0 - w, w )
+
+	total = va + vb + vc
+	if( total == 0.0 ):
+		return ( 0.0, 0.0 )	# zero area
+	return ( vb / total, vc / total )
+
+
+class TriangleBVH( object ):
+	'''
+	Bounding volume hierarchy over the triangles of a mesh, for closest
+	surface point queries.  coords is the flat point buffer and triangles a
+	flat [a0, b0, c0, a1, b1, c1, ...] list of vertex indices, as
+	MFnMesh.getTriangles() gives them.  Built with median splits on the
+	widest axis of the triangle centroids, like KDTree.
+	'''
+	leafSize = 4
+
+	def __init__( self, coords, triangles ):
+		self.coords = coords
+		self.triangles = triangles
+		self.count = len(triangles) // 3
+		self.order = array.array( 'i', range(self.count) )
+
+		self.nodeLo = array.array( 'i' )
+		self.nodeHi = array.array( 'i' )
+		self.nodeLeft = array.array( 'i' )
+		self.nodeRight = array.array( 'i' )
+		self.nodeBox = array.array( 'd' )	# min x, y, z, max x, y, z per node
+
+		if( self.count ):
+			self.build()
+
+
+	def addNode( self, lo, hi ):
+		c = self.coords
+		t = self.triangles
+		box = [ 9e99, 9e99, 9e99, -9e99, -9e99, -9e99 ]
+		for tri in self.order[lo:hi]:
+			for k in range( 3*tri, 3*tri + 3 ):
+				v = 3 * t[k]
+				for a in range( 0, 3 ):
+					if( c[v + a] < box[a] ):
+						box[a] = c[v + a]
+					if( c[v + a] > box[3 + a] ):
+						box[3 + a] = c[v + a]
+		self.nodeLo.append( lo )
+		self.nodeHi.append( hi )
+		self.nodeLeft.append( -1 )
+		self.nodeRight.append( -1 )
+		self.nodeBox.extend( box )
+		return len(self.nodeLo) - 1
+
+
+	def centroid( self, tri, axis ):
+		c = self.coords
+		t = self.triangles
+		return c[3*t[3*tri] + axis] + c[3*t[3*tri + 1] + axis] + c[3*t[3*tri + 2] + axis]
+
+
+	def build( self ):
+		order = self.order
+		stack = [ self.addNode( 0, self.count ) ]
+
+		while( stack ):
+			node = stack.pop()
+			lo = self.nodeLo[node]
+			hi = self.nodeHi[node]
+			if( hi - lo <= self.leafSize ):
+				continue
+
+			sub = order[lo:hi]
+			axis = 0
+			widest = -1.0
+			for a in range( 0, 3 ):
+				vals = [ self.centroid( tri, a ) for tri in sub ]
+				spread = max(vals) - min(vals)
+				if( spread > widest ):
+					axis = a
+					widest = spread
+
+			order[lo:hi] = array.array( 'i', sorted( sub, key=lambda tri: self.centroid( tri, axis ) ) )
+			mid = (lo + hi) // 2
+			self.nodeLeft[node] = self.addNode( lo, mid )
+			self.nodeRight[node] = self.addNode( mid, hi )
+			stack.append( self.nodeLeft[node] )
+			stack.append( self.nodeRight[node] )
+
+
+	def boxDistance( self, node, x, y, z ):
+		b = self.nodeBox
+		dx = max( b[6*node] - x, 0.0, x - b[6*node + 3] )
+		dy = max( b[6*node + 1] - y, 0.0, y - b[6*node + 4] )
+		dz = max( b[6*node + 2] - z, 0.0, z - b[6*node + 5] )
+		return dx*dx + dy*dy + dz*dz
+
+
+	def closest( self, x, y, z ):
+		'''( triangle, u, v ) of the closest surface point, triangle -1 when there are none'''
+		best = ( -1, 0.0, 0.0 )
+		bestDistance = 9e99
+		if( self.count == 0 ):
+			return best
+
+		c = self.coords
+		t = self.triangles
+		stack = [ (0, self.boxDistance( 0, x, y, z )) ]
+		while( stack ):
+			node, boxDistance = stack.pop()
+			if( boxDistance > bestDistance ):
+				continue
+
+			left = self.nodeLeft[node]
+			if( left == -1 ):
+				for tri in self.order[self.nodeLo[node]:self.nodeHi[node]]:
+					a = 3 * t[3*tri]
+					b = 3 * t[3*tri + 1]
+					v = 3 * t[3*tri + 2]
+					u, w = closestOnTriangle( x, y, z, c[a], c[a+1], c[a+2], c[b], c[b+1], c[b+2], c[v], c[v+1], c[v+2] )
+					qx = c[a] + u * (c[b] - c[a]) + w * (c[v] - c[a])
+					qy = c[a+1] + u * (c[b+1] - c[a+1]) + w * (c[v+1] - c[a+1])
+					qz = c[a+2] + u * (c[b+2] - c[a+2]) + w * (c[v+2] - c[a+2])
+					d = (qx - x)*(qx - x) + (qy - y)*(qy - y) + (qz - z)*(qz - z)
+					if( d < bestDistance or (d == bestDistance and tri < best[0]) ):
+						best = ( tri, u, w )
+						bestDistance = d
+				continue
+
+			right = self.nodeRight[node]
+			leftDistance = self.boxDistance( left, x, y, z )
+			rightDistance = self.boxDistance( right, x, y, z )
+			#visit the nearer child first:
+			if( leftDistance <= rightDistance ):
+				stack.append( (right, rightDistance) )
+				stack.append( (left, leftDistance) )
+			else:
+				stack.append( (left, leftDistance) )
+				stack.append( (right, rightDistance) )
+
+		return best
+
+
+#==================================================
+# Bind worker processes
+#
+# The bind builds its search over the driven points once and hands it to the
+# workers flattened, with the points, in shared memory: each worker only
+# wraps the arrays, so the pool holds one structure rather than one each.
+_bindShared = {}	# what a bind worker process sees, set up by bindWorkerInit
+
+def sharedView( shared, typecode='d' ):
+	try:
+		return memoryview( shared ).cast( 'B' ).cast( typecode )	# plain indexing, much cheaper than ctypes
+	except (AttributeError, TypeError):
+		return shared
+
+
+def bindWorkerInit( drivenShared, driverShared, radius, searchShared=None ):
+	#searchShared is the flattened search, { name: ( typecode, shared array ) },
+	#None when it could not be flattened and the worker builds its own:
+	driven = sharedView( drivenShared )
+	_bindShared['driver'] = sharedView( driverShared )
+	if( searchShared is None ):
+		_bindShared['search'] = SpatialHash( driven, radius ) if radius > 0 else KDTree( driven )
+		return
+	arrays = dict( ( name, sharedView( shared, typecode ) ) for name, ( typecode, shared ) in searchShared.items() )
+	_bindShared['search'] = SpatialHash.restore( driven, radius, arrays ) if radius > 0 else KDTree.restore( driven, arrays )
+
+
+def bindWorkerChunk( span ):
+	driver = _bindShared['driver']
+	search = _bindShared['search']
+	return [ search.nearest( driver[3*d], driver[3*d + 1], driver[3*d + 2] ) for d in range( span[0], span[1] ) ]